@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+import instrument
+import make_fake_corpus
+import mono
+import number_to_word
+import process_spl
+import split_dataset
+from manifest import load_manifest
+from util import normalize
+
+DEFAULT_RESULTS = 'benchmark-results.jsonl'
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the processing scripts on a fake NST corpus')
+    parser.add_argument('--corpus', type=str, help='existing fake corpus to use, it is modified by the mono benchmark (default: generate one in a temporary directory)')
+    parser.add_argument('--stations', type=int, help='number of stations in the generated corpus (default: 4)', default=4)
+    parser.add_argument('--speakers', type=int, help='number of speakers per station in the generated corpus (default: 25)', default=25)
+    parser.add_argument('--utterances', type=int, help='number of utterances per speaker in the generated corpus (default: 20)', default=20)
+    parser.add_argument('--seeds', type=int, help='number of seeds to evaluate in the seed search benchmark (default: 200)', default=200)
+    parser.add_argument('--results', type=str, help='file to append results to, one JSON object per line (default: {})'.format(DEFAULT_RESULTS), default=DEFAULT_RESULTS)
+    parser.add_argument('--skip-mono', help='don\'t run the mono benchmark', action='store_true')
+    return parser
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_manifest(file_name, results):
+    with open(file_name, 'w') as f:
+        f.write('wav_filename, duration_in_seconds, file_size, speaker_id, age, sex, region_of_birth, region_of_youth, transcript\n')
+        for sentences, _, metadata in results:
+            for (text, wav_file, duration_in_seconds, file_size) in sentences:
+                f.write("{}, {}, {}, {}, {}, {}, {}, {}, {}\n".format(wav_file, duration_in_seconds, file_size, metadata['speaker_id'], metadata['age'], metadata['sex'], metadata['region_of_birth'], metadata['region_of_youth'], text))
+
+
+def run_benchmarks(args, report):
+    spl_files = sorted(glob.glob("./train/**/*/*.spl", recursive=True))
+
+    with report.stage('process_spl.process') as stage:
+        results = []
+        for file_name in spl_files:
+            results.append(process_spl.process(file_name))
+            stage.add(sentences=len(results[-1][0]))
+    write_manifest('all-train.csv', results)
+
+    texts = [ text for sentences, _, _ in results for (text, _, _, _) in sentences ]
+    with report.stage('util.normalize') as stage:
+        for text in texts:
+            normalize(text)
+        stage.add(len(texts))
+
+    rng = random.Random(1337)
+    numbers = [ str(rng.randint(0, 10 ** rng.randint(1, 12))) for _ in range(100000) ]
+    number_to_word.to_words.cache_clear()
+    with report.stage('number_to_word.to_words') as stage:
+        for number in numbers:
+            number_to_word.to_words(number)
+        stage.add(len(numbers))
+
+    data = load_manifest('all-train.csv')
+    with report.stage('split_dataset.fix_data') as stage:
+        data = split_dataset.fix_data(data)
+        stage.add(len(data))
+
+    speaker_stats = split_dataset.build_speaker_stats(data)
+    matrix = split_dataset.build_speaker_matrix(speaker_stats)
+    split = {'train': 0.6, 'dev': 0.2, 'test': 0.2}
+    partitions = [ split_dataset.distribute_speakers(speaker_stats, split, seed) for seed in range(args.seeds) ]
+    # Small corpora often give sets missing a sex or region, check_balance
+    # scores those as unbalanced
+    with report.stage('split_dataset.check_balance') as stage:
+        for train, dev, test in partitions:
+            balanced = split_dataset.check_balance(speaker_stats, train, dev, test, split, False, False, matrix=matrix)
+            stage.add(balanced=int(balanced))
+
+    with report.stage('split_dataset seed search') as stage:
+        split_dataset._init_search(speaker_stats, split, False, False, (split_dataset.TH_GENDER, split_dataset.TH_DURATION, split_dataset.TH_REGION), matrix)
+        seeds = split_dataset.candidate_seeds(split_dataset.DEFAULT_SEED)
+        for _ in range(args.seeds):
+            balanced = split_dataset._evaluate_seed(next(seeds))
+            stage.add(balanced=int(balanced))
+
+    if not args.skip_mono:
+        with report.stage('mono.convert_dataset') as stage:
+            mono.convert_dataset('all-train.csv')
+            stage.add(len(texts))
+
+
+def main(args):
+    report = instrument.Report('benchmark')
+    cwd = os.getcwd()
+    results_file = os.path.abspath(args.results)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = args.corpus or tmp_dir
+        if not args.corpus:
+            make_fake_corpus.make_corpus(corpus, stations=args.stations, speakers=args.speakers, utterances=args.utterances)
+        os.chdir(corpus)
+        try:
+            run_benchmarks(args, report)
+        finally:
+            os.chdir(cwd)
+
+    result = report.as_dict()
+    result['revision'] = git_revision()
+    result['corpus'] = {'stations': args.stations, 'speakers': args.speakers, 'utterances': args.utterances} if not args.corpus else args.corpus
+
+    previous = None
+    if os.path.exists(results_file):
+        with open(results_file, 'r') as f:
+            lines = [ line for line in f if line.strip() ]
+        if lines:
+            previous = { stage['name']: stage for stage in json.loads(lines[-1])['stages'] }
+    with open(results_file, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+    print("\n{:<32} {:>10} {:>10} {:>14} {:>10}".format('benchmark', 'seconds', 'items', 'items/s', 'vs last'))
+    for stage in result['stages']:
+        change = ''
+        if previous and stage['name'] in previous and previous[stage['name']]['seconds'] > 0:
+            change = "{:+.1f}%".format((stage['seconds'] / previous[stage['name']]['seconds'] - 1) * 100)
+        print("{:<32} {:>10.3f} {:>10} {:>14.1f} {:>10}".format(stage['name'], stage['seconds'], stage['items'], stage['items_per_second'] or 0.0, change))
+    print("\nResults for revision {} appended to {}".format(result['revision'], results_file))
+
+
+if __name__ == "__main__":
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+
+from process_spl import BAD_FILES, clean_speaker_id, process_all, load_cache, save_cache
+
+DEFAULT_CATALOG = 'nst-catalog.sqlite'
+
+DATASETS = {
+    'train': './train/**/*/*.spl',
+    'test': './test/**/*/*.spl'
+}
+
+SCHEMA = """
+CREATE TABLE speakers (
+    speaker_id TEXT PRIMARY KEY
+);
+CREATE TABLE sessions (
+    session_id INTEGER PRIMARY KEY,
+    spl_file TEXT NOT NULL UNIQUE,
+    dataset TEXT NOT NULL,
+    speaker_id TEXT REFERENCES speakers(speaker_id),
+    age TEXT,
+    sex TEXT,
+    region_of_birth TEXT,
+    region_of_youth TEXT
+);
+CREATE TABLE utterances (
+    utterance_id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(session_id),
+    wav_file_name TEXT NOT NULL UNIQUE,
+    transcript TEXT NOT NULL,
+    duration REAL NOT NULL,
+    file_size INTEGER NOT NULL
+);
+CREATE INDEX sessions_speaker ON sessions(speaker_id);
+CREATE INDEX sessions_dataset_speaker ON sessions(dataset, speaker_id);
+CREATE INDEX utterances_session ON utterances(session_id);
+"""
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Build a SQLite catalog of all spl files in the train and test sets')
+    parser.add_argument('--catalog', type=str, help='path of catalog file (default: {})'.format(DEFAULT_CATALOG), default=DEFAULT_CATALOG)
+    parser.add_argument('--jobs', type=int, help='number of worker processes used to parse spl files (default: 1)', default=1)
+    parser.add_argument('--cache', type=str, help='path of spl cache file (default: catalog-spl-cache.pickle)', default='catalog-spl-cache.pickle')
+    parser.add_argument('--no-cache', help='parse every spl file, don\'t read or write the cache', action='store_true')
+    return parser
+
+
+def connect(file_name=DEFAULT_CATALOG):
+    conn = sqlite3.connect(file_name)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+# The catalog is built in a new file that replaces the old one when it's
+# complete, so a crash leaves the previous catalog intact
+def build_catalog(file_name, jobs=1, cache=None):
+    tmp_file = file_name + '.tmp'
+    for stale in (tmp_file, tmp_file + '-journal'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    conn = connect(tmp_file)
+    with conn:
+        conn.executescript(SCHEMA)
+
+        spl_files = []
+        for dataset, pattern in DATASETS.items():
+            spl_files.extend((dataset, spl_file) for spl_file in glob.glob(pattern, recursive=True))
+
+        results = process_all([ spl_file for _, spl_file in spl_files ], jobs=jobs, cache=cache)
+        for (dataset, spl_file), (sentences, _, metadata) in zip(spl_files, results):
+            if metadata['speaker_id'] is not None:
+                conn.execute("INSERT OR IGNORE INTO speakers (speaker_id) VALUES (?)", (metadata['speaker_id'],))
+            cursor = conn.execute("INSERT INTO sessions (spl_file, dataset, speaker_id, age, sex, region_of_birth, region_of_youth) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (spl_file, dataset, metadata['speaker_id'], metadata['age'], metadata['sex'], metadata['region_of_birth'], metadata['region_of_youth']))
+            session_id = cursor.lastrowid
+            conn.executemany("INSERT OR IGNORE INTO utterances (session_id, wav_file_name, transcript, duration, file_size) VALUES (?, ?, ?, ?, ?)",
+                             [ (session_id, wav_file, text, duration, file_size) for (text, wav_file, duration, file_size) in sentences if wav_file not in BAD_FILES ])
+        conn.execute("ANALYZE")
+    conn.close()
+    os.replace(tmp_file, file_name)
+
+    conn = connect(file_name)
+    for dataset in DATASETS:
+        sessions, utterances = conn.execute("SELECT COUNT(DISTINCT s.session_id), COUNT(u.utterance_id) FROM sessions s LEFT JOIN utterances u USING (session_id) WHERE s.dataset = ?", (dataset,)).fetchone()
+        print("{}: {} spl files, {} utterances".format(dataset, sessions, utterances))
+    conn.close()
+
+
+def _format(value):
+    # Same as the values in the csv files written by process_spl.py
+    return '{}'.format(value).strip()
+
+
+# Utterances of a dataset with the metadata of their session, as stored, in
+# the order of the spl files and their lines
+def iter_utterances(conn, dataset):
+    return conn.execute("""
+        SELECT u.wav_file_name, u.duration, u.file_size, s.speaker_id, s.age, s.sex, s.region_of_birth, s.region_of_youth, u.transcript
+        FROM utterances u JOIN sessions s USING (session_id)
+        WHERE s.dataset = ?
+        ORDER BY u.utterance_id
+    """, (dataset,))
+
+
+# Rows in the same format as split_dataset._iter_data, read from the cursor
+# one at a time
+def load_data(conn, dataset):
+    for row in iter_utterances(conn, dataset):
+        yield _row_to_data(row)
+
+
+def _row_to_data(row):
+    return {
+        'wav_file_name': row['wav_file_name'],
+        'duration': row['duration'],
+        'file_size': row['file_size'],
+        'speaker_id': _format(row['speaker_id']),
+        'age': _format(row['age']),
+        'sex': _format(row['sex']),
+        'region_of_birth': _format(row['region_of_birth']),
+        'region_of_youth': _format(row['region_of_youth']),
+        'text': row['transcript'].strip()
+    }
+
+
+# Rows where region of birth and region of youth differ. IS NOT keeps rows
+# where only one of them is NULL, like the csv files compare 'None' with a
+# region
+def load_non_matching_regions(conn, dataset):
+    rows = conn.execute("""
+        SELECT u.wav_file_name, u.duration, u.file_size, s.speaker_id, s.age, s.sex, s.region_of_birth, s.region_of_youth, u.transcript
+        FROM sessions s JOIN utterances u USING (session_id)
+        WHERE s.dataset = ? AND TRIM(s.region_of_birth) IS NOT TRIM(s.region_of_youth)
+        ORDER BY u.utterance_id
+    """, (dataset,))
+    for row in rows:
+        yield _row_to_data(row)
+
+
+# Same format as find_dup_speakers.build_speaker_index
+def load_speaker_index(conn):
+    index = {dataset: {} for dataset in DATASETS}
+    rows = conn.execute("SELECT dataset, speaker_id, spl_file FROM sessions ORDER BY session_id")
+    for row in rows:
+        speaker_id = clean_speaker_id(row['speaker_id'] or '')
+        if speaker_id != '':
+            index[row['dataset']].setdefault(speaker_id, []).append(row['spl_file'])
+    return index
+
+
+def main(args):
+    cache = None if args.no_cache else load_cache(args.cache)
+    build_catalog(args.catalog, jobs=args.jobs, cache=cache)
+    if cache is not None:
+        save_cache(args.cache, cache)
+
+
+if __name__ == "__main__":
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,79 @@
+import sys
+
+import numpy as np
+from tensorflow.python.ops import gen_audio_ops
+
+from compute_features import FEATURE_PARAMS, compute_mfcc, read_wav, read_wav_file_names
+
+# Largest difference allowed between compute_mfcc and TensorFlow, they sum
+# the filterbank and DCT in a different order (differences seen are around
+# float32 rounding)
+TOLERANCE = 1e-4
+
+
+# The features DeepSpeech computes for samples
+def tensorflow_mfcc(samples, params):
+    spectrogram = gen_audio_ops.audio_spectrogram(samples.reshape(-1, 1),
+                                                  window_size=params['sample_rate'] * params['win_len_ms'] // 1000,
+                                                  stride=params['sample_rate'] * params['win_step_ms'] // 1000,
+                                                  magnitude_squared=True)
+    mfcc = gen_audio_ops.mfcc(spectrogram, params['sample_rate'],
+                              upper_frequency_limit=params['upper_frequency'],
+                              lower_frequency_limit=params['lower_frequency'],
+                              filterbank_channel_count=params['n_filters'],
+                              dct_coefficient_count=params['n_mfcc'])
+    return np.asarray(mfcc)[0]
+
+
+# Noise, tones and silence, shorter than one window, exactly one window and
+# random lengths up to 3 seconds
+def generated_samples(count=20, seed=0):
+    rng = np.random.RandomState(seed)
+    sample_rate = FEATURE_PARAMS['sample_rate']
+    win_len = sample_rate * FEATURE_PARAMS['win_len_ms'] // 1000
+    lengths = [0, win_len - 1, win_len] + [ int(rng.randint(0, 3 * sample_rate)) for _ in range(count) ]
+    for i, length in enumerate(lengths):
+        t = np.arange(length) / sample_rate
+        if i % 3 == 0:
+            samples = rng.uniform(-1, 1, length)
+        elif i % 3 == 1:
+            samples = 0.5 * np.sin(2 * np.pi * rng.uniform(50, 7000) * t)
+        else:
+            samples = np.zeros(length)
+        yield 'generated-{}'.format(i), np.round(samples * 32767) / 32768.0
+
+
+def wav_samples(file_names):
+    for file_name in file_names:
+        if file_name.endswith('.csv'):
+            for wav_file_name in read_wav_file_names(file_name):
+                yield wav_file_name, read_wav(wav_file_name)[0]
+        else:
+            yield file_name, read_wav(file_name)[0]
+
+
+def check_features(named_samples):
+    count = 0
+    mismatches = 0
+    for name, samples in named_samples:
+        samples = samples.astype(np.float32)
+        expected = tensorflow_mfcc(samples, FEATURE_PARAMS)
+        actual = compute_mfcc(samples, FEATURE_PARAMS)
+        count += 1
+        if expected.shape != actual.shape:
+            mismatches += 1
+            print("Shape mismatch for {}: expected {}, actual {}".format(name, expected.shape, actual.shape))
+        elif expected.size and np.abs(expected - actual).max() > TOLERANCE:
+            mismatches += 1
+            print("Mismatch for {}: max difference {}".format(name, np.abs(expected - actual).max()))
+    print("Checked {} files, {} mismatches".format(count, mismatches))
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        named_samples = wav_samples(sys.argv[1:])
+    else:
+        named_samples = generated_samples()
+    if not check_features(named_samples):
+        sys.exit(1)
@@ -0,0 +1,85 @@
+import re
+import sys
+
+from number_to_word import to_words
+from split_dataset import load_train
+from util import normalize, units, re_square, re_cubic, re_combine_digits, re_sep_decimals, re_digit_range, re_remove_silent_date, re_numbers, re_spaces, re_replace_all
+
+# The original, one replace/regex at a time, implementation of util.normalize
+re_units = {}
+for key, _ in units.items():
+    re_units[key] = re.compile(r"\b{0}(²|³)?\b".format(re.escape(key)))
+
+
+def normalize_reference(text, is_nst=False, remove_spaces_between_digits=True):
+    text = text.lower()
+    text = re_remove_silent_date.sub('', text)
+    text = text.replace('|', '')
+    text = text.replace('"', '')
+    text = text.replace('.', '')
+    text = text.replace('(', '')
+    text = text.replace(')', '')
+    text = text.replace('[', '')
+    text = text.replace(']', '')
+    text = text.replace("_", " ")
+    text = text.replace("\\", " ")
+    text = text.replace("é", "e")
+    text = text.replace("&", "och")
+    text = text.replace(u'\xa0', ' ')
+    if not is_nst:
+        for key, pattern in re_units.items():
+            replacement = r"{0}\1".format(re.escape(units[key]))
+            text = pattern.sub(replacement, text)
+        text = re_square.sub(r"kvadrat\1", text)
+        text = re_cubic.sub(r"kubik\1", text)
+        if remove_spaces_between_digits:
+            text = re_combine_digits.sub(r"\1\3", text)
+        text = re_sep_decimals.sub(r"\1 komma \2", text)
+        text = re_digit_range.sub(r"\1 till \2", text)
+    text = text.replace('-', ' ')
+    text = text.replace('%', 'procent')
+    def number_to_word(match):
+        match = match.group()
+        word = match
+        try:
+            word = to_words(match)
+        except ValueError as ex:
+            print('Failed to convert "{}": {}'.format(match, ex))
+        return word
+    text = re_numbers.sub(number_to_word, text)
+    text = re_replace_all.sub('', text)
+    text = re_spaces.sub(' ', text)
+    return text.strip()
+
+
+# The text normalize_reference got for NST transcripts, the original
+# split_dataset._load_data split lines on ',' and joined the text fields with
+# ', '
+def original_nst_text(text):
+    return ', '.join(text.split(','))
+
+
+def check_normalize(texts):
+    count = 0
+    mismatches = 0
+    for text in texts:
+        for is_nst in [True, False]:
+            for remove_spaces_between_digits in [True, False]:
+                expected = normalize_reference(original_nst_text(text) if is_nst else text, is_nst=is_nst, remove_spaces_between_digits=remove_spaces_between_digits)
+                actual = normalize(text, is_nst=is_nst, remove_spaces_between_digits=remove_spaces_between_digits)
+                count += 1
+                if expected != actual:
+                    mismatches += 1
+                    print("Mismatch for \"{}\" (is_nst={}, remove_spaces_between_digits={}):\n\texpected: \"{}\"\n\tactual:   \"{}\"".format(text, is_nst, remove_spaces_between_digits, expected, actual))
+    print("Checked {} normalizations, {} mismatches".format(count, mismatches))
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            texts = [ line.rstrip('\n') for line in f ]
+    else:
+        texts = [ d['text'] for d in load_train() ]
+    if not check_normalize(texts):
+        sys.exit(1)
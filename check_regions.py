@@ -1,3 +1,6 @@
+import argparse
+import sys
+
 from split_dataset import load_train, load_test
 
 def check_regions(data):
@@ -13,7 +16,17 @@ def check_regions(data):
     print("unique non matching:", len(speaker_ids))
 
 
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Check how many speakers have different region of youth and region of birth')
+    parser.add_argument('--catalog', type=str, help='query a catalog built by catalog.py instead of reading all-train.csv')
+    return parser
+
+
 if __name__ == "__main__":
-    all_data = load_train()
+    args = load_arg_parser().parse_args(sys.argv[1:])
+    if args.catalog:
+        import catalog
+        all_data = catalog.load_non_matching_regions(catalog.connect(args.catalog), 'train')
+    else:
+        all_data = load_train()
     check_regions(all_data)
-
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import wave
+from multiprocessing import Pool
+
+import numpy as np
+
+# Same features as DeepSpeech computes with TensorFlow,
+# audio_spectrogram(magnitude_squared=True) followed by mfcc with its default
+# filterbank. compute_mfcc follows TensorFlow's kernels step by step (see
+# check_features.py), so the cached features can be fed to a model instead
+# of the ones it computes itself.
+FEATURE_PARAMS = {
+    'type': 'mfcc',
+    'implementation': 'tensorflow.audio_spectrogram+mfcc',
+    'sample_rate': 16000,
+    'win_len_ms': 32,
+    'win_step_ms': 20,
+    'n_mfcc': 26,
+    'n_filters': 40,
+    'lower_frequency': 20.0,
+    'upper_frequency': 4000.0,
+    'dtype': 'float32'
+}
+
+DEFAULT_SHARD_FRAMES = 4000000
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Compute acoustic features once for split csv files and store them in memory mapped shards')
+    parser.add_argument('files', nargs='+', help='split csv files, e.g. train.csv dev.csv test.csv')
+    parser.add_argument('--out-dir', type=str, help='directory to write shards and indexes to (default: features)', default='features')
+    parser.add_argument('--jobs', type=int, help='number of worker processes used to compute features (default: 1)', default=1)
+    parser.add_argument('--shard-frames', type=int, help='max number of feature frames per shard (default: {})'.format(DEFAULT_SHARD_FRAMES), default=DEFAULT_SHARD_FRAMES)
+    return parser
+
+
+def read_wav(file_name):
+    with wave.open(file_name, 'rb') as wav:
+        params = wav.getparams()
+        frames = wav.readframes(params.nframes)
+    if params.sampwidth != 2:
+        raise ValueError('Only 16 bit wav files are supported: {}'.format(file_name))
+    samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768.0
+    if params.nchannels > 1:
+        samples = samples[:len(samples) - len(samples) % params.nchannels].reshape(-1, params.nchannels).mean(axis=1)
+    return samples, params.framerate
+
+
+def _freq_to_mel(hz):
+    return 1127.0 * np.log1p(hz / 700.0)
+
+
+# TensorFlow's MfccMelFilterbank as a (spectrogram bins, filters) matrix that
+# is applied to the magnitude. Every bin between the lower and upper limit
+# (DC excluded) goes to the filter whose center is above it with weight w and
+# to the next filter with 1 - w.
+def mel_filterbank(params, n_bins):
+    n_filters = params['n_filters']
+    lower = params['lower_frequency']
+    upper = params['upper_frequency']
+    mel_low = _freq_to_mel(lower)
+    mel_spacing = (_freq_to_mel(upper) - mel_low) / (n_filters + 1)
+    centers = mel_low + mel_spacing * np.arange(1, n_filters + 2)
+    hz_per_bin = 0.5 * params['sample_rate'] / (n_bins - 1)
+    start = int(1.5 + lower / hz_per_bin)
+    end = int(upper / hz_per_bin)
+
+    filters = np.zeros((n_bins, n_filters))
+    for i in range(start, min(end, n_bins - 1) + 1):
+        mel = _freq_to_mel(i * hz_per_bin)
+        channel = int(np.searchsorted(centers[:n_filters], mel, side='left')) - 1
+        if channel >= 0:
+            weight = (centers[channel + 1] - mel) / (centers[channel + 1] - centers[channel])
+            filters[i, channel] += weight
+        else:
+            weight = (centers[0] - mel) / (centers[0] - mel_low)
+        if channel + 1 < n_filters:
+            filters[i, channel + 1] += 1.0 - weight
+    return filters
+
+
+# TensorFlow's MfccDct, a DCT-II scaled by sqrt(2 / n_filters) for every
+# coefficient
+def dct_matrix(n_filters, n_mfcc):
+    n = np.arange(n_filters)
+    k = np.arange(n_mfcc)[:, None]
+    return (np.sqrt(2.0 / n_filters) * np.cos(np.pi / n_filters * k * (n + 0.5))).T
+
+
+# Same as TensorFlow's audio_spectrogram(magnitude_squared=True) and mfcc:
+# periodic Hann window, power spectrum in double precision rounded to
+# float32, mel filterbank on the magnitude, log with a floor of 1e-12 and
+# the unnormalized DCT. Audio shorter than one window has no frames.
+def compute_mfcc(samples, params):
+    win_len = params['sample_rate'] * params['win_len_ms'] // 1000
+    win_step = params['sample_rate'] * params['win_step_ms'] // 1000
+    n_fft = 1 << (win_len - 1).bit_length()
+    n_bins = n_fft // 2 + 1
+    frame_count = 1 + (len(samples) - win_len) // win_step if len(samples) >= win_len else 0
+    indexes = np.arange(win_len)[None, :] + win_step * np.arange(frame_count)[:, None]
+    window = 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(win_len) / win_len)
+    frames = samples.astype(np.float64)[indexes] * window
+    spectrum = np.fft.rfft(frames, n=n_fft)
+    power = (spectrum.real ** 2 + spectrum.imag ** 2).astype(np.float32).astype(np.float64)
+    mel = np.sqrt(power) @ mel_filterbank(params, n_bins)
+    mel = np.log(np.maximum(mel, 1e-12))
+    return (mel @ dct_matrix(params['n_filters'], params['n_mfcc'])).astype(params['dtype'])
+
+
+def compute_features(file_name):
+    samples, sample_rate = read_wav(file_name)
+    if sample_rate != FEATURE_PARAMS['sample_rate']:
+        raise ValueError('Expected sample rate {}, got {}: {}'.format(FEATURE_PARAMS['sample_rate'], sample_rate, file_name))
+    return compute_mfcc(samples, FEATURE_PARAMS)
+
+
+# Returns (features, None), or (None, error message) if the file can't be
+# read, so that one bad file doesn't stop a whole split
+def try_compute_features(file_name):
+    try:
+        return compute_features(file_name), None
+    except (OSError, EOFError, wave.Error, ValueError) as ex:
+        return None, str(ex) or ex.__class__.__name__
+
+
+def read_wav_file_names(file_name):
+    with open(file_name, "r") as f:
+        f.readline() # Skip header row
+        for line in f:
+            yield line.split(",", 1)[0].strip()
+
+
+def cache_split(csv_file, out_dir, jobs=1, shard_frames=DEFAULT_SHARD_FRAMES):
+    name = os.path.splitext(os.path.basename(csv_file))[0]
+    csv_stat = os.stat(csv_file)
+    index = {
+        'params': FEATURE_PARAMS,
+        'source': {'file': os.path.abspath(csv_file), 'size': csv_stat.st_size, 'mtime_ns': csv_stat.st_mtime_ns},
+        'shards': [],
+        'entries': {},
+        'errors': {}
+    }
+    pending = []
+    pending_frames = 0
+
+    def write_shard():
+        shard = "{}-{:05d}.npy".format(name, len(index['shards']))
+        np.save(os.path.join(out_dir, shard), np.concatenate(pending))
+        index['shards'].append(shard)
+
+    wav_file_names = list(read_wav_file_names(csv_file))
+    pool = Pool(jobs) if jobs > 1 else None
+    try:
+        results = pool.imap(try_compute_features, wav_file_names, chunksize=32) if pool else map(try_compute_features, wav_file_names)
+        for wav_file_name, (features, error) in zip(wav_file_names, results):
+            if error:
+                print("Failed to compute features for {}: {}".format(wav_file_name, error))
+                index['errors'][wav_file_name] = error
+                continue
+            if pending and pending_frames + len(features) > shard_frames:
+                write_shard()
+                pending = []
+                pending_frames = 0
+            index['entries'][wav_file_name] = [len(index['shards']), pending_frames, len(features)]
+            pending.append(features)
+            pending_frames += len(features)
+    finally:
+        if pool:
+            pool.terminate()
+    if pending:
+        write_shard()
+
+    index_file = os.path.join(out_dir, "{}.index.json".format(name))
+    with open(index_file, 'w') as f:
+        json.dump(index, f)
+    print("Cached features for {} files from {} in {} shards, {} failed, index: {}".format(len(index['entries']), csv_file, len(index['shards']), len(index['errors']), index_file))
+    return index_file
+
+
+class StaleCacheError(Exception):
+    pass
+
+
+# Reads features from the shards written by cache_split. Shards are memory
+# mapped, so only the slices that are used are read from disk.
+class FeatureCache:
+    def __init__(self, index_file, params=FEATURE_PARAMS):
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if index['params'] != params:
+            raise StaleCacheError('Feature parameters changed since {} was written'.format(index_file))
+        source = index['source']
+        try:
+            stat = os.stat(source['file'])
+        except FileNotFoundError:
+            raise StaleCacheError('{}, which {} was written from, no longer exists'.format(source['file'], index_file))
+        if (stat.st_size, stat.st_mtime_ns) != (source['size'], source['mtime_ns']):
+            raise StaleCacheError('{} changed since {} was written'.format(source['file'], index_file))
+        directory = os.path.dirname(index_file)
+        self.shards = [ np.load(os.path.join(directory, shard), mmap_mode='r') for shard in index['shards'] ]
+        self.entries = index['entries']
+        self.errors = index.get('errors', {})
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, wav_file_name):
+        return wav_file_name in self.entries
+
+    def __getitem__(self, wav_file_name):
+        shard, start, length = self.entries[wav_file_name]
+        return self.shards[shard][start:start + length]
+
+
+def main(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    for csv_file in args.files:
+        cache_split(csv_file, args.out_dir, jobs=args.jobs, shard_frames=args.shard_frames)
+
+
+if __name__ == "__main__":
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -1,39 +1,112 @@
-from util import load_processed_train, load_processed_test, load_processed_dev
-from split_dataset import load_train, load_test
+import argparse
+import hashlib
+import itertools
+import sys
+from collections import Counter
+
+from split_dataset import _iter_data, filter_reason
+from util import normalize
+
+# Columns that hold the same thing in both unprocessed (process_spl.py) and
+# processed (split_dataset.py) csv files, and so can be compared
+COMPARED_COLUMNS = ['file_size', 'text']
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Diff unprocessed and processed csv files, list files that were filtered out and why')
+    parser.add_argument('--old', nargs='+', help='unprocessed csv files (default: all-train.csv all-test.csv)', default=['all-train.csv', 'all-test.csv'])
+    parser.add_argument('--new', nargs='+', help='processed csv files (default: train.csv dev.csv real-test-2.csv)', default=['train.csv', 'dev.csv', 'real-test-2.csv'])
+    parser.add_argument('--catalog', type=str, help='read the unprocessed data from a catalog built by catalog.py instead of the --old files')
+    return parser
+
+
+# Yields every row of the csv files as a dict with the same keys as
+# split_dataset._load_data. Unprocessed files are read by _iter_data so that
+# transcripts containing commas are joined the same way as when splitting.
+def read_manifests(file_names):
+    for file_name in file_names:
+        with open(file_name, "r") as f:
+            header = f.readline()
+        if 'duration_in_seconds' in header:
+            yield from _iter_data(file_name)
+            continue
+        with open(file_name, "r") as f:
+            f.readline() # Skip header row
+            for line in f:
+                row = line.rstrip("\n").split(",", 2)
+                yield {
+                    'wav_file_name': row[0].strip(),
+                    'file_size': int(row[1].strip()),
+                    'text': row[2].strip()
+                }
+
+
+# Short hash of the compared columns, unprocessed transcripts are normalized
+# like split_dataset.fix_data first so they can be compared with processed ones
+def row_digest(data, normalize_text=False):
+    text = normalize(data['text'], is_nst=True) if normalize_text else data['text']
+    values = [ str(data.get(column, '')) for column in COMPARED_COLUMNS[:-1] ] + [ text ]
+    return hashlib.blake2b("\x1f".join(values).encode('utf-8'), digest_size=8).digest()
+
+
+# Diffs two sets of rows keyed by wav_file_name. old and new are functions
+# returning a fresh iterable of rows, old is read twice. Only keys and hashes
+# are kept in memory, never whole rows.
+# Returns (added keys, changed keys, {removed key: (filter reason, row if
+# the reason is unknown)})
+def diff_manifests(old, new, normalize_old=True):
+    digests = {}
+    for data in old():
+        digests[data['wav_file_name']] = row_digest(data, normalize_text=normalize_old)
+
+    added = []
+    changed = []
+    for data in new():
+        key = data['wav_file_name']
+        digest = digests.pop(key, None)
+        if digest is None:
+            added.append(key)
+        elif digest != row_digest(data):
+            changed.append(key)
+
+    removed = {}
+    if digests:
+        for data in old():
+            if data['wav_file_name'] in digests:
+                reason = filter_reason(data) or 'unknown'
+                # Rows without a known reason are kept to be listed
+                removed[data['wav_file_name']] = (reason, data if reason == 'unknown' else None)
+    return added, changed, removed
 
 
 if __name__ == "__main__":
-    train_processed = load_processed_train()
-    test_processed = load_processed_test()
-    dev_processed = load_processed_dev()
-    train = load_train()
-    test = load_test()
-
-    total = {}
-    total_count = len(train) + len(test)
-    for item in train + test:
-        total[item["wav_file_name"]] = item
-
-    for item in train_processed + dev_processed + test_processed:
-        try:
-            del total[item["wav_file_name"]]
-        except KeyError as e:
-            print("file not found: {}".format(e))
+    args = load_arg_parser().parse_args(sys.argv[1:])
+    if args.catalog:
+        import catalog
+        conn = catalog.connect(args.catalog)
+        old = lambda: itertools.chain(catalog.load_data(conn, 'train'), catalog.load_data(conn, 'test'))
+    else:
+        old = lambda: read_manifests(args.old)
+    new = lambda: read_manifests(args.new)
+
+    total_count = sum(1 for _ in old())
+    added, changed, removed = diff_manifests(old, new)
+
+    for key in added:
+        print("file not found: '{}'".format(key))
+    for key in changed:
+        print("file changed: '{}'".format(key))
 
     with open("filtered_files.txt", "w") as out:
-        tystnad_count = 0
-        duration_count = 0
-        total_removed = len(total)
-
-        for item in total.values():
-            if (item["text"] == "( ... tyst under denna inspelning ...)"):
-                tystnad_count += 1
-            elif (item["duration"] >= 10.0):
-                duration_count += 1
-            else:
+        reasons = Counter()
+        for key, (reason, item) in removed.items():
+            reasons[reason] += 1
+            if reason == 'unknown':
                 out.write("{}, {}, {}\n".format(item["wav_file_name"], item["duration"], item["text"]))
 
-        print("Amount of silent files: {}, {}%".format(tystnad_count, (tystnad_count/total_count)*100))
-        print("Amount of files with too long duration: {}, {}%".format(duration_count, (duration_count/total_count) * 100))
-        print("Total removed: {}, {}%".format(total_removed, total_removed/total_count))
-        print("Total: {}".format(total_count))
\ No newline at end of file
+        for reason, count in reasons.most_common():
+            print("Amount of files removed as {}: {}, {}%".format(reason, count, (count/total_count)*100))
+        print("Total added: {}".format(len(added)))
+        print("Total changed: {}".format(len(changed)))
+        print("Total removed: {}, {}%".format(len(removed), len(removed)/total_count))
+        print("Total: {}".format(total_count))
@@ -1,29 +1,69 @@
+import argparse
 import glob
+import json
+import sys
+from multiprocessing import Pool
 
-def find_dupes():
-    speakers = set()
-    for file_name in glob.glob("./test/**/*/*.spl", recursive=True):
-        with open(file_name, encoding='latin-1') as f:
-            for line in f:
-                if "1=Speaker ID>" in line:
-                    line = line.replace("1=Speaker ID>", "", 1)
-                    line = ''.join(c for c in line if c.isdigit())
-                    line = line.strip()
-                    if line != "":
-                        speakers.add(line)
+from process_spl import clean_speaker_id, read_metadata
 
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Find speakers that exist in both the test and train sets')
+    parser.add_argument('--jobs', type=int, help='number of worker processes used to read spl files (default: 1)', default=1)
+    parser.add_argument('--index', type=str, help='path of speaker -> spl file index (default: speaker-index.json)', default='speaker-index.json')
+    parser.add_argument('--catalog', type=str, help='query a catalog built by catalog.py instead of reading the spl files')
+    parser.add_argument('--use-index', help='check using an index written by an earlier run instead of reading the spl files', action='store_true')
+    return parser
+
+
+def read_speaker_id(file_name):
+    speaker_id = read_metadata(file_name).get('speaker_id')
+    return clean_speaker_id(speaker_id) if speaker_id else ''
+
+
+# Returns {'train': {speaker_id: [spl files]}, 'test': {...}}, both trees are
+# read by the same pool of workers
+def build_speaker_index(jobs=1):
+    files = {
+        'test': glob.glob("./test/**/*/*.spl", recursive=True),
+        'train': glob.glob("./train/**/*/*.spl", recursive=True)
+    }
+    all_files = files['test'] + files['train']
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            speaker_ids = pool.map(read_speaker_id, all_files, chunksize=64)
+    else:
+        speaker_ids = [ read_speaker_id(file_name) for file_name in all_files ]
+    speaker_ids = dict(zip(all_files, speaker_ids))
+
+    index = {}
+    for name, file_names in files.items():
+        index[name] = {}
+        for file_name in file_names:
+            speaker_id = speaker_ids[file_name]
+            if speaker_id != "":
+                index[name].setdefault(speaker_id, []).append(file_name)
+    return index
+
+
+def save_index(index, file_name):
+    with open(file_name, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+
+
+def load_index(file_name):
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+
+def find_dupes(index):
     dup_count = 0
     duplicate_files = set()
-    for file_name in glob.glob("./train/**/*/*.spl", recursive=True):
-        with open(file_name, encoding='latin-1') as f:
-            for line in f:
-                if "1=Speaker ID>" in line:
-                    line = line.replace("1=Speaker ID>", "", 1)
-                    line = ''.join(c for c in line if c.isdigit())
-                    if line in speakers:
-                        print("Found duplicate speaker \"{0}\" in file: {1}".format(line, file_name))
-                        duplicate_files.add(file_name)
-                        dup_count += 1
+    for speaker_id in sorted(set(index['train']) & set(index['test'])):
+        for file_name in index['train'][speaker_id]:
+            print("Found duplicate speaker \"{0}\" in file: {1}".format(speaker_id, file_name))
+            duplicate_files.add(file_name)
+            dup_count += 1
 
     print("Found {0} duplicates".format(dup_count))
     print("Files to remove:")
@@ -35,5 +75,19 @@ def find_dupes():
         f = f.replace(".spl", "/")
         print(f)
 
+
+def main(args):
+    if args.catalog:
+        import catalog
+        index = catalog.load_speaker_index(catalog.connect(args.catalog))
+    elif args.use_index:
+        index = load_index(args.index)
+    else:
+        index = build_speaker_index(jobs=args.jobs)
+        save_index(index, args.index)
+    find_dupes(index)
+
+
 if __name__ == "__main__":
-    find_dupes()
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
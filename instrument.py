@@ -0,0 +1,129 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+
+# Timer and counters for one stage of a run. items is the main count used for
+# throughput and ETA, counters holds any other counts and timers holds time
+# spent in named parts of the stage.
+class Stage:
+    def __init__(self, name, total=None, progress_interval=None):
+        self.name = name
+        self.total = total
+        self.progress_interval = progress_interval
+        self.items = 0
+        self.counters = {}
+        self.timers = {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.last_progress = self.start
+
+    def elapsed(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def add(self, items=1, **counters):
+        self.items += items
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        if self.progress_interval and time.perf_counter() - self.last_progress >= self.progress_interval:
+            self.print_progress()
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + time.perf_counter() - start
+
+    # Adds timings measured elsewhere, e.g. in worker processes, see timed
+    def add_timers(self, timers):
+        for name, seconds in timers.items():
+            self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    def print_progress(self):
+        self.last_progress = time.perf_counter()
+        elapsed = self.elapsed()
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+        line = "[{}] {}".format(self.name, self.items)
+        if self.total:
+            line += "/{} ({:.1f}%)".format(self.total, self.items / self.total * 100)
+        line += ", {:.1f}/s, elapsed {}".format(rate, format_seconds(elapsed))
+        if self.total and rate > 0:
+            line += ", ETA {}".format(format_seconds((self.total - self.items) / rate))
+        print(line, file=sys.stderr)
+
+    def as_dict(self):
+        elapsed = self.elapsed()
+        return {
+            'name': self.name,
+            'seconds': elapsed,
+            'items': self.items,
+            'items_per_second': self.items / elapsed if elapsed > 0 else None,
+            'counters': self.counters,
+            'timers': self.timers
+        }
+
+
+# Adds the time spent in the block to timers[name], timers being a plain dict
+# that worker processes can return with their results to be merged into
+# Stage.timers with Stage.add_timers. Timers summed over several workers can
+# add up to more than the wall time of the stage.
+@contextmanager
+def timed(timers, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timers[name] = timers.get(name, 0.0) + time.perf_counter() - start
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{:d}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+# Collects the stages of one run of a script, e.g.
+#
+#   report = Report('process_spl', progress_interval=10)
+#   with report.stage('parse', total=len(files)) as stage:
+#       for f in files:
+#           stage.add(sentences=...)
+#   report.save('report.json')
+class Report:
+    def __init__(self, name, progress_interval=None):
+        self.name = name
+        self.progress_interval = progress_interval
+        self.stages = []
+        self.start = time.time()
+
+    @contextmanager
+    def stage(self, name, total=None):
+        stage = Stage(name, total=total, progress_interval=self.progress_interval)
+        self.stages.append(stage)
+        try:
+            yield stage
+        finally:
+            stage.end = time.perf_counter()
+            if self.progress_interval:
+                stage.print_progress()
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'started': self.start,
+            'argv': sys.argv,
+            'seconds': sum(stage.elapsed() for stage in self.stages),
+            'stages': [ stage.as_dict() for stage in self.stages ]
+        }
+
+    def save(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+def add_arguments(parser):
+    parser.add_argument('--report', type=str, help='write timings and counters of every stage to this JSON file')
+    parser.add_argument('--progress', type=float, help='print progress of long stages every PROGRESS seconds')
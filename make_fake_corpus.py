@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import random
+import struct
+import sys
+import wave
+
+REGIONS = [
+    'Stockholm med omnejd', 'Göteborg med omnejd', 'Skåne', 'Småland med öarna',
+    'Västergötland', 'Östergötland', 'Norrland', 'Dalarna', 'Värmland'
+]
+
+WORDS = [
+    'det', 'var', 'en', 'gång', 'katt', 'som', 'hette', 'Måns', 'och', 'bodde',
+    'i', 'ett', 'hus', 'vid', 'sjön', 'styrelsen', 'beslutade', 'att', 'bygga',
+    'vägen', 'över', 'ån', 'blanda', 'ner', 'potatis', 'grädde', 'ägg'
+]
+
+UNITS = ['mm', 'cm', 'm', 'km', 'ml', 'cl', 'dl', 'l', 'm²', 'm³']
+
+SILENT = '( ... tyst under denna inspelning ...)'
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Generate a fake NST corpus with spl files and short wav files, for testing and benchmarking')
+    parser.add_argument('--out-dir', type=str, help='directory to create the corpus in (default: fake-nst)', default='fake-nst')
+    parser.add_argument('--dataset', type=str, help='name of the dataset folder, train or test (default: train)', default='train')
+    parser.add_argument('--stations', type=int, help='number of Stasjon folders (default: 2)', default=2)
+    parser.add_argument('--speakers', type=int, help='number of speakers (spl files) per station (default: 10)', default=10)
+    parser.add_argument('--utterances', type=int, help='number of utterances per speaker (default: 20)', default=20)
+    parser.add_argument('--max-duration', type=float, help='max duration of wav files in seconds (default: 3.0)', default=3.0)
+    parser.add_argument('--seed', type=int, help='random seed (default: 1337)', default=1337)
+    return parser
+
+
+def random_text(rng):
+    roll = rng.random()
+    if roll < 0.02:
+        return SILENT
+    words = [ rng.choice(WORDS) for _ in range(rng.randint(3, 10)) ]
+    if roll < 0.5:
+        words.insert(rng.randrange(len(words)), str(rng.randint(0, 99999)))
+    if roll < 0.3:
+        words.insert(rng.randrange(len(words)), "{},{} {}".format(rng.randint(0, 99), rng.randint(0, 9), rng.choice(UNITS)))
+    if roll < 0.2:
+        words.insert(rng.randrange(len(words)), "{}-{} {}".format(rng.randint(1, 5), rng.randint(6, 10), rng.choice(UNITS)))
+    if roll < 0.1:
+        words.append("{}%".format(rng.randint(1, 100)))
+    text = ' '.join(words)
+    return text[0].upper() + text[1:] + '.'
+
+
+def write_wav(file_name, rng, max_duration, sample_rate=16000, channels=2):
+    frames = int(sample_rate * rng.uniform(0.5, max_duration))
+    noise = [ rng.randint(-200, 200) for _ in range(256) ]
+    block = struct.pack('<{}h'.format(len(noise)), *noise)
+    data = (block * (frames * channels * 2 // len(block) + 1))[:frames * channels * 2]
+    with wave.open(file_name, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(data)
+
+
+# Lines in the same format as the NST spl files, parsed by process_spl.process
+def write_spl(file_name, speaker_id, metadata, utterances):
+    with open(file_name, 'w', encoding='latin-1') as f:
+        f.write("[System]\nANSI Codepage=1252\n\n")
+        f.write("[Info states]\n")
+        f.write("1=Speaker ID>-<{}>-<\n".format(speaker_id))
+        f.write("2=Name>-<Fake Speaker {}>-<\n".format(speaker_id))
+        f.write("3=Age>-<{}>-<\n".format(metadata['age']))
+        f.write("4=Sex>-<{}>-<\n".format(metadata['sex']))
+        f.write("5=Region of Birth>-<{}>-<\n".format(metadata['region_of_birth']))
+        f.write("6=Region of Youth>-<{}>-<\n".format(metadata['region_of_youth']))
+        f.write("7=Remarks>-<>-<\n\n")
+        f.write("[Session]\n1=Session>-<1>-<\n\n")
+        f.write("[Validation states]\n")
+        for i, (text, wav_file) in enumerate(utterances):
+            f.write("{}={}>-<1>-<0>-<0>-<0>-<0>-<{}>-<16000>-<2>-<16>-<0>-<0>-<\n".format(i + 1, text, wav_file))
+        f.write("\n[End]\n")
+
+
+def make_corpus(out_dir, dataset='train', stations=2, speakers=10, utterances=20, max_duration=3.0, seed=1337):
+    rng = random.Random(seed)
+    spl_count = 0
+    wav_count = 0
+    speaker_id = 0
+    for station in range(1, stations + 1):
+        for speaker in range(speakers):
+            speaker_id += 1
+            session = "{:02d}{:02d}".format(station, speaker // 100 + 1)
+            base = os.path.join(out_dir, dataset, "Stasjon{}".format(station), "010799", "adb_0467")
+            data_folder = os.path.join(base, "data", "scr0467", "{:02d}".format(station), "0467" + session)
+            spl_name = "r467{:04d}".format(speaker_id)
+            speech_folder = os.path.join(base, "speech", "scr0467", "{:02d}".format(station), "0467" + session, spl_name)
+            os.makedirs(data_folder, exist_ok=True)
+            os.makedirs(speech_folder, exist_ok=True)
+
+            region_of_youth = rng.choice(REGIONS)
+            metadata = {
+                'age': rng.randint(18, 80),
+                'sex': ['Male', 'Female'][speaker_id % 2],
+                'region_of_birth': region_of_youth if rng.random() < 0.8 else rng.choice(REGIONS),
+                'region_of_youth': region_of_youth
+            }
+            rows = []
+            for utterance in range(utterances):
+                wav_file = "u{:04d}{:03d}.wav".format(speaker_id, utterance)
+                write_wav(os.path.join(speech_folder, wav_file), rng, max_duration)
+                rows.append((random_text(rng), wav_file))
+                wav_count += 1
+            write_spl(os.path.join(data_folder, spl_name + ".spl"), speaker_id, metadata, rows)
+            spl_count += 1
+    print("Created {} spl files and {} wav files in {}".format(spl_count, wav_count, os.path.join(out_dir, dataset)))
+
+
+def main(args):
+    make_corpus(args.out_dir, dataset=args.dataset, stations=args.stations, speakers=args.speakers, utterances=args.utterances, max_duration=args.max_duration, seed=args.seed)
+
+
+if __name__ == "__main__":
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,521 @@
+import gc
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+from array import array
+
+BINARY_MAGIC = b'NSTMANI\x01'
+BINARY_SUFFIX = '.manifest'
+
+# Columns of the csv files written by process_spl.py, in file order, and how
+# they are stored: 'str' as a list, 'float' and 'int' as typed arrays and
+# 'category' as an array of codes into the list of distinct values
+RAW_COLUMNS = [
+    ('wav_file_name', 'str'),
+    ('duration', 'float'),
+    ('file_size', 'int'),
+    ('speaker_id', 'category'),
+    ('age', 'category'),
+    ('sex', 'category'),
+    ('region_of_birth', 'category'),
+    ('region_of_youth', 'category'),
+    ('text', 'str')
+]
+
+# Columns of the split csv files written by split_dataset.py
+PROCESSED_COLUMNS = [
+    ('wav_file_name', 'str'),
+    ('file_size', 'int'),
+    ('text', 'str')
+]
+
+
+# Parses one line of a process_spl.py csv file into the values of
+# RAW_COLUMNS. The transcript is the last column, so commas in it are kept.
+def parse_line(line):
+    row = line.split(",", 8)
+    return (
+        row[0].strip(),
+        float(row[1].strip()),
+        int(row[2].strip()),
+        row[3].strip(),
+        row[4].strip(),
+        row[5].strip(),
+        row[6].strip(),
+        row[7].strip(),
+        row[8].strip()
+    )
+
+
+# Parses one line of a split_dataset.py csv file into the values of
+# PROCESSED_COLUMNS
+def parse_processed_line(line):
+    row = line.split(",", 2)
+    return (row[0].strip(), int(row[1].strip()), row[2].strip())
+
+
+# Column of repeated values stored once each, rows hold a code into values
+class Categorical:
+    def __init__(self, values=None, codes=None):
+        self.values = values if values is not None else []
+        self.index = { value: code for code, value in enumerate(self.values) }
+        self.codes = codes if codes is not None else array('I')
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def append(self, value):
+        self.codes.append(self.code(value))
+
+    def extend(self, values):
+        index = self.index
+        for value in dict.fromkeys(values):
+            if value not in index:
+                index[value] = len(self.values)
+                self.values.append(value)
+        self.codes.extend(array('I', map(index.__getitem__, values)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def __iter__(self):
+        values = self.values
+        return ( values[code] for code in self.codes )
+
+    def take(self, indices):
+        codes = self.codes
+        return Categorical(list(self.values), array('I', ( codes[i] for i in indices )))
+
+    # New column with func applied once per distinct value instead of once per
+    # row, values that become equal share a code
+    def map(self, func):
+        result = Categorical()
+        recode = [ result.code(func(value)) for value in self.values ]
+        result.codes = array('I', map(recode.__getitem__, self.codes))
+        return result
+
+
+# Read only column of strings stored as utf-8 in a memory mapped binary
+# manifest, strings are only decoded when they are read
+class StringColumn:
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def __iter__(self):
+        data = self.data
+        offsets = self.offsets
+        return ( str(data[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(len(offsets) - 1) )
+
+
+def _new_column(kind):
+    if kind == 'float':
+        return array('d')
+    if kind == 'int':
+        return array('q')
+    if kind == 'category':
+        return Categorical()
+    return []
+
+
+def _take(column, indices):
+    if isinstance(column, Categorical):
+        return column.take(indices)
+    if isinstance(column, array):
+        return array(column.typecode, ( column[i] for i in indices ))
+    if isinstance(column, memoryview):
+        return array(column.format, ( column[i] for i in indices ))
+    return [ column[i] for i in indices ]
+
+
+# Manifest stored by column instead of as one dict per row. Iterating or
+# indexing gives rows as dicts with the same keys as split_dataset._load_data,
+# so code written for lists of rows keeps working, while code that knows
+# about the columns can work on them directly, e.g.
+#
+#   manifest = load_manifest('all-train.csv')
+#   short = manifest.filter(lambda duration: duration < 10.0, 'duration')
+#   rows_by_speaker = short.group_by('speaker_id')
+class Manifest:
+    def __init__(self, columns=None, schema=RAW_COLUMNS):
+        self.names = [ name for name, _ in schema ]
+        self.schema = schema
+        self.columns = columns if columns is not None else { name: _new_column(kind) for name, kind in schema }
+
+    @classmethod
+    def from_rows(cls, rows, schema=RAW_COLUMNS):
+        manifest = cls(schema=schema)
+        manifest.extend([ tuple(row[name] for name, _ in schema) for row in rows ])
+        return manifest
+
+    def append(self, values):
+        for name, value in zip(self.names, values):
+            self.columns[name].append(value)
+
+    # Appends many rows, each a tuple of values in schema order
+    def extend(self, rows):
+        self.extend_columns(zip(*rows))
+
+    # Appends many rows given as one sequence of values per column
+    def extend_columns(self, columns):
+        for name, values in zip(self.names, columns):
+            self.columns[name].extend(values)
+
+    def __len__(self):
+        return len(self.columns[self.names[0]])
+
+    def __getitem__(self, i):
+        return { name: self.columns[name][i] for name in self.names }
+
+    def __iter__(self):
+        names = self.names
+        for values in zip(*( self.columns[name] for name in names )):
+            yield dict(zip(names, values))
+
+    def column(self, name):
+        return self.columns[name]
+
+    # Manifest with only the columns of schema, sharing them with this one
+    def select(self, schema):
+        return Manifest({ name: self.columns[name] for name, _ in schema }, schema)
+
+    def take(self, indices):
+        return Manifest({ name: _take(column, indices) for name, column in self.columns.items() }, self.schema)
+
+    # Indices of the rows where predicate(value) is true for the values of
+    # the given columns, categorical columns are tested once per distinct value
+    def where(self, predicate, *names):
+        if len(names) == 1 and isinstance(self.columns[names[0]], Categorical):
+            column = self.columns[names[0]]
+            matches = [ bool(predicate(value)) for value in column.values ]
+            return array('I', ( i for i, code in enumerate(column.codes) if matches[code] ))
+        columns = [ self.columns[name] for name in names ]
+        return array('I', ( i for i, values in enumerate(zip(*columns)) if predicate(*values) ))
+
+    def filter(self, predicate, *names):
+        return self.take(self.where(predicate, *names))
+
+    # {value: array of row indices} in order of first appearance
+    def group_by(self, name):
+        column = self.columns[name]
+        if not isinstance(column, Categorical):
+            values = column
+            column = Categorical()
+            column.extend(values)
+        groups = {}
+        for i, code in enumerate(column.codes):
+            rows = groups.get(code)
+            if rows is None:
+                rows = groups[code] = array('I')
+            rows.append(i)
+        return { column.values[code]: rows for code, rows in groups.items() }
+
+
+# Reads a process_spl.py csv file. If a binary manifest written from the csv
+# file sits next to it (see binary_file), that is read instead.
+def load_manifest(file_name, chunk_bytes=1 << 23):
+    binary = binary_file(file_name)
+    if binary:
+        return open_binary(binary)
+    return _load_csv(file_name, chunk_bytes)
+
+
+# Reads a split_dataset.py csv file, or the binary manifest next to it
+def load_processed_manifest(file_name):
+    binary = binary_file(file_name)
+    if binary:
+        return open_binary(binary)
+    manifest = Manifest(schema=PROCESSED_COLUMNS)
+    with open(file_name, "r") as f:
+        f.readline() # Skip header row
+        manifest.extend([ parse_processed_line(line) for line in f ])
+    return manifest
+
+
+# Reads the csv file chunk_bytes of lines at a time. The garbage collector is
+# paused while reading, the split rows are short lived but would otherwise
+# trigger a collection every few hundred rows.
+def _load_csv(file_name, chunk_bytes):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        manifest = _read_csv(file_name, chunk_bytes)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    for name, kind in RAW_COLUMNS:
+        if kind == 'category':
+            manifest.columns[name] = manifest.columns[name].map(str.strip)
+    return manifest
+
+
+def _read_csv(file_name, chunk_bytes):
+    manifest = Manifest()
+    with open(file_name, "r") as f:
+        f.readline() # Skip header row
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            # Same as parse_line, but one column at a time. Categorical
+            # columns are stripped by _load_csv, once per distinct value.
+            rows = [ line.split(",", 8) for line in lines ]
+            manifest.extend_columns([
+                [ row[0].strip() for row in rows ],
+                [ float(row[1]) for row in rows ],
+                [ int(row[2]) for row in rows ],
+                [ row[3] for row in rows ],
+                [ row[4] for row in rows ],
+                [ row[5] for row in rows ],
+                [ row[6] for row in rows ],
+                [ row[7] for row in rows ],
+                [ row[8].strip() for row in rows ]
+            ])
+    return manifest
+
+
+# Path of the binary manifest for a csv file, e.g. all-train.manifest for
+# all-train.csv
+def binary_file_name(file_name):
+    return os.path.splitext(file_name)[0] + BINARY_SUFFIX
+
+
+# The binary manifest to read for file_name: file_name itself if it is one,
+# or the one next to a csv file if it is at least as new as the csv file
+def binary_file(file_name):
+    if file_name.endswith(BINARY_SUFFIX):
+        return file_name
+    binary = binary_file_name(file_name)
+    try:
+        if os.stat(binary).st_mtime_ns >= os.stat(file_name).st_mtime_ns:
+            return binary
+    except OSError:
+        pass
+    return None
+
+
+# Binary manifest layout: BINARY_MAGIC, the length of a JSON header as an
+# unsigned 64 bit integer, the header and then one block per column, each
+# starting at a multiple of 8 bytes. Numbers and codes are stored in native
+# byte order, strings as an array of offsets into their utf-8 encoded data.
+def write_binary(manifest, file_name):
+    blocks = []
+    columns = {}
+    offset = 0
+
+    def add_block(data):
+        nonlocal offset
+        start = offset
+        blocks.append(data)
+        offset += len(data)
+        padding = -offset % 8
+        if padding:
+            blocks.append(bytes(padding))
+            offset += padding
+        return [start, len(data)]
+
+    for name, kind in manifest.schema:
+        column = manifest.columns[name]
+        if kind == 'category':
+            columns[name] = {'codes': add_block(array('I', column.codes).tobytes()), 'values': column.values}
+        elif kind == 'str':
+            data = bytearray()
+            offsets = array('Q', [0])
+            for value in column:
+                data += value.encode('utf-8')
+                offsets.append(len(data))
+            columns[name] = {'offsets': add_block(offsets.tobytes()), 'data': add_block(bytes(data))}
+        else:
+            typecode = 'd' if kind == 'float' else 'q'
+            columns[name] = {'data': add_block(array(typecode, column).tobytes())}
+
+    _write_binary_file(file_name, len(manifest), manifest.schema, columns, blocks)
+
+
+# Writes the header and blocks of a binary manifest, blocks are bytes or
+# files that are copied from their start
+def _write_binary_file(file_name, rows, schema, columns, blocks):
+    header = json.dumps({
+        'rows': rows,
+        'byteorder': sys.byteorder,
+        'schema': schema,
+        'columns': columns
+    }).encode('utf-8')
+    header += b' ' * (-(len(BINARY_MAGIC) + 8 + len(header)) % 8)
+
+    # Write to a temporary file first so readers never see half a manifest
+    tmp_file = file_name + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for block in blocks:
+            if isinstance(block, (bytes, bytearray)):
+                f.write(block)
+            else:
+                block.seek(0)
+                shutil.copyfileobj(block, f)
+    os.replace(tmp_file, file_name)
+
+
+# One block of a binary manifest written by BinaryWriter, values are
+# collected in a typed array (or bytes) and moved to a temporary file
+# whenever it gets large
+class _SpilledBlock:
+    FLUSH_BYTES = 1 << 20
+
+    def __init__(self, typecode=None):
+        self.file = tempfile.TemporaryFile()
+        self.buffer = array(typecode) if typecode else bytearray()
+        self.size = 0
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) * self.buffer.itemsize >= self.FLUSH_BYTES:
+            self.flush()
+
+    def extend(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.FLUSH_BYTES:
+            self.flush()
+
+    def flush(self):
+        data = self.buffer.tobytes() if isinstance(self.buffer, array) else bytes(self.buffer)
+        self.file.write(data)
+        self.size += len(data)
+        del self.buffer[:]
+
+    def close(self):
+        self.file.close()
+
+
+# Writes a binary manifest one row at a time, with the same layout as
+# write_binary. Only the distinct values of category columns are kept in
+# memory, everything else goes to temporary files that close() copies into
+# the manifest.
+class BinaryWriter:
+    def __init__(self, file_name, schema=RAW_COLUMNS):
+        self.file_name = file_name
+        self.schema = schema
+        self.rows = 0
+        self.categories = {}
+        self.blocks = {}
+        self.string_sizes = {}
+        for name, kind in schema:
+            if kind == 'category':
+                self.categories[name] = Categorical()
+                self.blocks[name] = [_SpilledBlock('I')]
+            elif kind == 'str':
+                self.blocks[name] = [_SpilledBlock('Q'), _SpilledBlock()]
+                self.blocks[name][0].append(0)
+                self.string_sizes[name] = 0
+            else:
+                self.blocks[name] = [_SpilledBlock('d' if kind == 'float' else 'q')]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    # row holds the values of schema, in order
+    def append(self, row):
+        for (name, kind), value in zip(self.schema, row):
+            blocks = self.blocks[name]
+            if kind == 'category':
+                blocks[0].append(self.categories[name].code(value))
+            elif kind == 'str':
+                data = value.encode('utf-8')
+                self.string_sizes[name] += len(data)
+                blocks[0].append(self.string_sizes[name])
+                blocks[1].extend(data)
+            else:
+                blocks[0].append(value)
+        self.rows += 1
+
+    def close(self):
+        blocks = []
+        columns = {}
+        offset = 0
+
+        def add_block(block):
+            nonlocal offset
+            block.flush()
+            start = offset
+            blocks.append(block.file)
+            offset += block.size
+            padding = -offset % 8
+            if padding:
+                blocks.append(bytes(padding))
+                offset += padding
+            return [start, block.size]
+
+        try:
+            for name, kind in self.schema:
+                column = self.blocks[name]
+                if kind == 'category':
+                    columns[name] = {'codes': add_block(column[0]), 'values': self.categories[name].values}
+                elif kind == 'str':
+                    columns[name] = {'offsets': add_block(column[0]), 'data': add_block(column[1])}
+                else:
+                    columns[name] = {'data': add_block(column[0])}
+            _write_binary_file(self.file_name, self.rows, self.schema, columns, blocks)
+        finally:
+            self.discard()
+
+    # Removes the temporary files without writing the manifest
+    def discard(self):
+        for column in self.blocks.values():
+            for block in column:
+                block.close()
+
+
+# Opens a binary manifest without reading it, numbers and codes are views of
+# the memory mapped file and strings are decoded as they are read
+def open_binary(file_name):
+    with open(file_name, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if bytes(view[:len(BINARY_MAGIC)]) != BINARY_MAGIC:
+        raise ValueError('Not a binary manifest: {}'.format(file_name))
+    start = len(BINARY_MAGIC) + 8
+    header_size = int.from_bytes(view[len(BINARY_MAGIC):start], 'little')
+    header = json.loads(str(view[start:start + header_size], 'utf-8'))
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError('Binary manifest written on a {} endian machine: {}'.format(header['byteorder'], file_name))
+    data_start = start + header_size
+
+    def block(location, typecode='B'):
+        begin = data_start + location[0]
+        return view[begin:begin + location[1]].cast(typecode)
+
+    schema = [ tuple(column) for column in header['schema'] ]
+    columns = {}
+    for name, kind in schema:
+        column = header['columns'][name]
+        if kind == 'category':
+            columns[name] = Categorical(column['values'], block(column['codes'], 'I'))
+        elif kind == 'str':
+            columns[name] = StringColumn(block(column['offsets'], 'Q'), block(column['data']))
+        else:
+            columns[name] = block(column['data'], 'd' if kind == 'float' else 'q')
+    return Manifest(columns, schema)
@@ -1,14 +1,36 @@
+import argparse
 import subprocess
 import os
 import sys
+import wave
+from multiprocessing import Pool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import instrument
+import wav_probe
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 DEV_NULL = open(os.devnull, 'w')
 
+# Sample widths (in bytes) that can be downmixed in process, 8 bit wav is unsigned
+SAMPLE_TYPES = {
+    1: 'u1',
+    2: '<i2',
+    4: '<i4'
+}
+
 
 def confirm_is_mono(file_name):
     try:
-        channels = int(subprocess.check_output(["soxi", "-c", file_name], stderr=DEV_NULL))
-        return channels == 1
+        return wav_probe.channels(file_name) == 1
     except subprocess.CalledProcessError as ex:
         print("Exception when checking: {0}".format(ex))
         return False
@@ -21,40 +43,211 @@ def convert_to_mono(file_name, overwrite=True):
     if not code == 0:
         return False # Failed to convert
     if overwrite:
-        code = subprocess.call(['mv', out_file, file_name], stdout=DEV_NULL, stderr=DEV_NULL)
-    return code == 0
+        try:
+            os.replace(out_file, file_name)
+        except OSError:
+            return False
+    return True
 
 
-def convert_dataset(file_name):
-    failed = 0
-    not_mono = 0
-    print("Converting all sound files specified in {} to mono...".format(file_name))
+# Downmixes a PCM wav file by averaging its channels, without spawning ffmpeg.
+# Returns None if the file can't be handled in process.
+def downmix_in_process(file_name, info):
+    if np is None or info['sample_width'] not in SAMPLE_TYPES:
+        return None
+    out_file = file_name.replace(".wav", "_mono.wav", 1)
+    try:
+        with wave.open(file_name, 'rb') as wav:
+            params = wav.getparams()
+            frames = wav.readframes(params.nframes)
+    except (wave.Error, EOFError):
+        return None
+
+    dtype = np.dtype(SAMPLE_TYPES[params.sampwidth])
+    samples = np.frombuffer(frames, dtype=dtype)
+    samples = samples[:len(samples) - len(samples) % params.nchannels].reshape(-1, params.nchannels)
+    mono = np.round(samples.mean(axis=1)).astype(dtype)
+
+    try:
+        with wave.open(out_file, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(params.sampwidth)
+            wav.setframerate(params.framerate)
+            wav.writeframes(mono.tobytes())
+        os.replace(out_file, file_name)
+    except OSError:
+        return False
+    return True
+
+
+# Journal of files that are known to be mono, set once per worker process
+_journal = None
+
+
+def _init_worker(journal_file):
+    global _journal
+    _journal = (journal_file, load_journal(journal_file)) if journal_file else None
+
+
+# Every line is file name, size and mtime (ns) of a file that was mono after
+# conversion, separated by tabs. Lines from an interrupted write are ignored.
+def load_journal(journal_file):
+    entries = {}
+    try:
+        with open(journal_file, "r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    continue
+                row = line.rstrip("\n").split("\t")
+                if len(row) != 3:
+                    continue
+                try:
+                    entries[row[0]] = (int(row[1]), int(row[2]))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+# Safe to call from several processes at once, every entry is a single
+# O_APPEND write done while holding an exclusive lock on the journal
+def append_journal(journal_file, file_name):
+    stat = os.stat(file_name)
+    line = "{}\t{}\t{}\n".format(file_name, stat.st_size, stat.st_mtime_ns).encode('utf-8')
+    fd = os.open(journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def is_journaled(file_name):
+    if not _journal or file_name not in _journal[1]:
+        return False
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return False
+    return _journal[1][file_name] == (stat.st_size, stat.st_mtime_ns)
+
+
+# Returns one of 'journaled' (done in an earlier run), 'skipped' (already
+# mono), 'converted', 'failed' or 'not_mono'. timers, if given, gets the time
+# spent in every part of the conversion, see convert_file_timed.
+def convert_file(file_name, timers=None):
+    timers = {} if timers is None else timers
+    with instrument.timed(timers, 'journal'):
+        journaled = is_journaled(file_name)
+    if journaled:
+        return 'journaled'
+    result = _convert_file(file_name, timers)
+    if _journal and result in ['skipped', 'converted']:
+        with instrument.timed(timers, 'journal'):
+            append_journal(_journal[0], file_name)
+    return result
+
+
+# Returns (convert_file(file_name), timers), for use in worker processes
+def convert_file_timed(file_name):
+    timers = {}
+    result = convert_file(file_name, timers)
+    return result, timers
+
+
+def _convert_file(file_name, timers):
+    with instrument.timed(timers, 'probe'):
+        try:
+            info = wav_probe.probe(file_name, ['channels', 'sample_width'])
+        except (OSError, subprocess.CalledProcessError):
+            info = None
+    if info and info['channels'] == 1:
+        return 'skipped'
+
+    with instrument.timed(timers, 'downmix'):
+        success = downmix_in_process(file_name, info) if info else None
+    if success is None:
+        with instrument.timed(timers, 'ffmpeg'):
+            success = convert_to_mono(file_name, overwrite=True)
+    if not success:
+        return 'failed'
+    with instrument.timed(timers, 'confirm_mono'):
+        mono = confirm_is_mono(file_name)
+    if not mono:
+        return 'not_mono'
+    return 'converted'
+
+
+def read_file_names(file_name):
     with open(file_name, "r") as f:
         f.readline() # Skip header row
         for line in f:
-            wav_file_name = line.split(",", 1)[0]
-            success = convert_to_mono(wav_file_name, overwrite=True)
-            if not success:
-                print("Failed to convert {}".format(wav_file_name))
-                failed += 1
-                continue
-            success = confirm_is_mono(wav_file_name)
-            if not success:
-                print("Not mono: {}".format(wav_file_name))
-                not_mono += 1
-                continue
-    print("Coverting to mono complete.\nFailed: {}\nNon monoL: {}".format(failed, not_mono))
+            yield line.split(",", 1)[0]
+
+
+def convert_dataset(file_name, jobs=1, journal_file=None, report=None):
+    report = report or instrument.Report('mono')
+    failed = 0
+    not_mono = 0
+    skipped = 0
+    journaled = 0
+    print("Converting all sound files specified in {} to mono...".format(file_name))
+    wav_file_names = read_file_names(file_name)
+    pool = Pool(jobs, initializer=_init_worker, initargs=(journal_file,)) if jobs > 1 else None
+    if not pool:
+        _init_worker(journal_file)
+    total = sum(1 for _ in read_file_names(file_name)) if report.progress_interval else None
+    try:
+        if pool:
+            results = pool.imap(convert_file_timed, wav_file_names, chunksize=64)
+        else:
+            results = map(convert_file_timed, wav_file_names)
+        with report.stage('convert', total=total) as stage:
+            for wav_file_name, (result, timers) in zip(read_file_names(file_name), results):
+                stage.add_timers(timers)
+                stage.add(**{result: 1})
+                if result == 'journaled':
+                    journaled += 1
+                elif result == 'skipped':
+                    skipped += 1
+                elif result == 'failed':
+                    print("Failed to convert {}".format(wav_file_name))
+                    failed += 1
+                elif result == 'not_mono':
+                    print("Not mono: {}".format(wav_file_name))
+                    not_mono += 1
+    finally:
+        if pool:
+            pool.terminate()
+    print("Coverting to mono complete.\nFailed: {}\nNon monoL: {}\nAlready mono: {}\nDone in earlier run: {}".format(failed, not_mono, skipped, journaled))
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Downmix all sound files in a dataset to mono')
+    parser.add_argument('target', type=str, help='dataset to convert, either "train" (all-train.csv) or "test" (all-test.csv)')
+    parser.add_argument('--jobs', type=int, help='number of worker processes used to convert files (default: 1)', default=1)
+    parser.add_argument('--journal', type=str, help='path of journal of finished files, used to resume an interrupted run (default: <input file>.mono-journal)')
+    parser.add_argument('--no-journal', help='don\'t read or write a journal, check every file', action='store_true')
+    instrument.add_arguments(parser)
+    return parser
 
 
 if __name__ == "__main__":
-    if len(sys.argv) <= 1:
-        print("Must specify either \"train\" or \"test\"")
-        sys.exit(1)
-    target = sys.argv[1].strip()
+    args = load_arg_parser().parse_args(sys.argv[1:])
+    target = args.target.strip()
     if target == "train":
-        convert_dataset("all-train.csv")
+        file_name = "all-train.csv"
     elif target == "test":
-        convert_dataset("all-test.csv")
+        file_name = "all-test.csv"
     else:
         print("Unknown target \"{}\"".format(target))
         sys.exit(1)
+    journal_file = None
+    if not args.no_journal:
+        journal_file = args.journal or file_name + ".mono-journal"
+    report = instrument.Report('mono', progress_interval=args.progress)
+    convert_dataset(file_name, jobs=args.jobs, journal_file=journal_file, report=report)
+    if args.report:
+        report.save(args.report)
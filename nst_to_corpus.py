@@ -1,26 +1,119 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
 import sys
+from array import array
 
-from split_dataset import load_train, load_test
+from split_dataset import _iter_data, filter_text
+from util import normalize_many
 
+DEFAULT_DEDUPE_SIZE = 10000000
+# Largest share of the slots of a HashSet that is used
+MAX_LOAD = 0.7
 
-if __name__ == "__main__":
-    args = sys.argv[1:]
-    if len(args) != 2:
-        print("usage: ./nst_to_corpus.py <train/test> <destination.txt>")
-        sys.exit(1)
-    source = args[0].strip()
-    destination = args[1].strip()
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Export transcripts as a language model corpus, one normalized sentence per line')
+    parser.add_argument('source', type=str, help='"train" (all-train.csv), "test" (all-test.csv) or the path of a split csv file written by split_dataset.py')
+    parser.add_argument('destination', type=str, help='path of corpus file to write')
+    parser.add_argument('--dedupe', help='only write the first occurrence of every sentence', action='store_true')
+    parser.add_argument('--dedupe-size', type=int, help='max number of sentences remembered by --dedupe, 8 bytes per table slot, 128 MB at the default (default: {})'.format(DEFAULT_DEDUPE_SIZE), default=DEFAULT_DEDUPE_SIZE)
+    parser.add_argument('--jobs', type=int, help='number of worker processes used to normalize transcripts (default: 1)', default=1)
+    return parser
+
+
+# Transcripts of all-train.csv/all-test.csv, normalized the same way as in
+# split_dataset.fix_data
+def raw_sentences(file_name, jobs=1):
+    texts = ( d['text'] for d in _iter_data(file_name) if not filter_text(d['text']) )
+    return normalize_many(texts, jobs=jobs, is_nst=True)
+
+
+# Transcripts of a split csv file, these are already normalized
+def split_sentences(file_name):
+    with open(file_name, "r") as f:
+        f.readline() # Skip header row
+        for line in f:
+            yield line.rstrip('\n').split(",", 2)[2]
+
+
+# Set of 64 bit hashes in a preallocated open addressing table (linear
+# probing) of uint64 slots, 0 marks an empty slot. The table has a power of
+# two slots, enough for max_size hashes at MAX_LOAD, and never grows: once
+# max_size hashes are in the set new ones aren't added.
+class HashSet:
+    def __init__(self, max_size):
+        # At least one slot more than max_size, so a probe always ends at an
+        # empty slot
+        min_slots = int(max_size / MAX_LOAD) + 1
+        self.slots = array('Q', [0]) * (1 << (min_slots - 1).bit_length())
+        self.mask = len(self.slots) - 1
+        self.max_size = max_size
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # Returns False if key is already in the set, otherwise adds it (if the
+    # set isn't full) and returns True
+    def add(self, key):
+        key = key or 1
+        slots = self.slots
+        mask = self.mask
+        i = key & mask
+        while slots[i] != 0:
+            if slots[i] == key:
+                return False
+            i = (i + 1) & mask
+        if self.size < self.max_size:
+            slots[i] = key
+            self.size += 1
+        return True
+
+
+# Skips sentences already seen. Only a 64 bit hash of every sentence is kept,
+# and at most max_size of them, so memory use is bounded.
+def dedupe(sentences, max_size=DEFAULT_DEDUPE_SIZE):
+    seen = HashSet(max_size)
+    for sentence in sentences:
+        key = int.from_bytes(hashlib.blake2b(sentence.encode('utf-8'), digest_size=8).digest(), 'little')
+        if seen.add(key):
+            yield sentence
+
+
+def export(sentences, destination):
+    count = 0
+    with open(destination, 'w') as f:
+        for sentence in sentences:
+            sentence = sentence.strip()
+            if sentence == '':
+                continue
+            f.write(sentence)
+            f.write('\n')
+            count += 1
+    return count
+
+
+def main(args):
+    source = args.source.strip()
+    destination = args.destination.strip()
 
     if source == "train":
-        data = load_train()
+        sentences = raw_sentences('all-train.csv', jobs=args.jobs)
     elif source == "test":
-        data = load_test()
+        sentences = raw_sentences('all-test.csv', jobs=args.jobs)
+    elif source.endswith(".csv"):
+        sentences = split_sentences(source)
     else:
-        print("unknown dataset:", source, "(should be train or test)")
+        print("unknown dataset:", source, "(should be train, test or a csv file)")
         sys.exit(1)
 
-    sentences = ' '.join([d['text'] for d in data])
+    if args.dedupe:
+        sentences = dedupe(sentences, max_size=args.dedupe_size)
+    count = export(sentences, destination)
+    print("Wrote {} sentences to {}".format(count, destination))
 
-    with open(destination, 'w') as f:
-        f.write(sentences)
+
+if __name__ == "__main__":
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -1,5 +1,7 @@
-import math
+import random
 import sys
+import time
+from functools import lru_cache
 
 TEN = 10
 ONE_HUNDRED = 100
@@ -7,8 +9,24 @@ ONE_THOUSAND = 1000
 ONE_MILLION = 1000000
 ONE_BILLION = 1000000000            # 1.000.000.000 (9)
 ONE_TRILLION = 1000000000000        # 1.000.000.000.000 (12)
-ONE_QUADRILLION = 1000000000000000  # 1.000.000.000.000.000 (15)
-MAX = 999999999999999              # 9.007.199.254.740.992 (15)
+ONE_QUADRILLION = 10 ** 15         # biljard (15)
+ONE_QUINTILLION = 10 ** 18         # triljon (18)
+ONE_SEXTILLION = 10 ** 21          # triljard (21)
+ONE_SEPTILLION = 10 ** 24          # kvadriljon (24)
+ONE_OCTILLION = 10 ** 27           # kvadriljard (27)
+MAX = 10 ** 30 - 1                 # 999 kvadriljarder ... (30 digits)
+
+# Divisor and name of every magnitude from a million up, largest first
+SCALES = [
+    (ONE_OCTILLION, ' kvadriljard'),
+    (ONE_SEPTILLION, ' kvadriljon'),
+    (ONE_SEXTILLION, ' triljard'),
+    (ONE_QUINTILLION, ' triljon'),
+    (ONE_QUADRILLION, ' biljard'),
+    (ONE_TRILLION, ' biljon'),
+    (ONE_BILLION, ' miljard'),
+    (ONE_MILLION, ' miljon')
+]
 
 LESS_THAN_TWENTY = [
     'noll', 'ett', 'två', 'tre', 'fyra', 'fem',
@@ -23,11 +41,28 @@ TENTHS_LESS_THAN_HUNDRED = [
 ]
 
 
+# Words for every number below ONE_TABLE, built once with the same rules as
+# generate_words so that the output is identical
+ONE_TABLE = 10000
+TABLE = ['']
+for n in range(1, ONE_TABLE):
+    if (n < 20):
+        TABLE.append(LESS_THAN_TWENTY[n])
+    elif (n < ONE_HUNDRED):
+        TABLE.append(TENTHS_LESS_THAN_HUNDRED[n // TEN] + TABLE[n % TEN])
+    elif (n < ONE_THOUSAND):
+        TABLE.append(LESS_THAN_TWENTY[n // ONE_HUNDRED] + 'hundra' + TABLE[n % ONE_HUNDRED])
+    else:
+        TABLE.append(TABLE[n // ONE_THOUSAND] + ' tusen ' + TABLE[n % ONE_THOUSAND])
+
+
 # Converts an integer into words.
 # If number is decimal, the decimals will be removed.
-# @example to_words(12) => 'twelve'
+# Results are cached since the same numbers show up over and over in transcripts.
+# @example to_words(12) => 'tolv'
 # @param {number|string} number
 # @returns {string}
+@lru_cache(maxsize=65536)
 def to_words(number):
     try:
         num = int(number)
@@ -37,53 +72,86 @@ def to_words(number):
     if (num == 0):
         return "noll"
     if (abs(num) > MAX):
-        raise ValueError('Value is too large (>999999999999)')
+        raise ValueError('Value is too large (>{})'.format(MAX))
     words = generate_words(num)
     return words
 
 def recurse(number, prefix, suffix, divisor):
-    remainder = number % divisor
-    num = math.floor(number / divisor)
+    num, remainder = divmod(number, divisor)
     if (num == 1):
         return prefix + 'en ' + suffix + " " + generate_words(remainder)
     else:
         return prefix + generate_words(num) + suffix + 'er ' + generate_words(remainder)
 
+# Only integer arithmetic (divmod) is used, so the result is exact for every
+# number up to MAX in size, also above 2^53
 def generate_words(number):
-    remainder = 0
     word = ''
 
-    # We’re done
-    if (number == 0):
-        return ''
-
     # If negative, prepend “minus”
     if (number < 0):
-        word = 'minus '
         number = abs(number)
+        if (number < 20):
+            return LESS_THAN_TWENTY[number]
+        word = 'minus '
 
-    if (number < 20):
-        remainder = 0
-        return LESS_THAN_TWENTY[number]
-    elif (number < ONE_HUNDRED):
-        remainder = number % 10
-        return word + TENTHS_LESS_THAN_HUNDRED[math.floor(number / TEN)] \
-            + generate_words(remainder)
-    elif (number < ONE_THOUSAND):
-        remainder = number % ONE_HUNDRED
-        return word + LESS_THAN_TWENTY[math.floor(number / ONE_HUNDRED)] \
-            + 'hundra' + generate_words(remainder)
+    if (number < ONE_TABLE):
+        return word + TABLE[number]
     elif (number < ONE_MILLION):
-        remainder = number % ONE_THOUSAND
-        return word + generate_words(math.floor(number/ONE_THOUSAND)) \
-            + ' tusen ' + generate_words(remainder)
-    elif (number < ONE_BILLION):
-        return recurse(number, word, ' miljon', ONE_MILLION)
-    elif (number < ONE_TRILLION):
-        return recurse(number, word, ' miljard', ONE_BILLION)
-    elif (number < ONE_QUADRILLION):
-        return recurse(number, word, ' biljon', ONE_TRILLION)
+        num, remainder = divmod(number, ONE_THOUSAND)
+        return word + generate_words(num) + ' tusen ' + TABLE[remainder]
+    for divisor, suffix in SCALES:
+        if (number >= divisor):
+            return recurse(number, word, suffix, divisor)
+
+
+# Known outputs around the limits of floats and of the old implementation
+CHECKS = [
+    (2 ** 53 - 1, 'nio biljarder sju biljoner etthundranittionio miljarder tvåhundrafemtiofyra miljoner sjuhundrafyrtio tusen niohundranittioett'),
+    (2 ** 53, 'nio biljarder sju biljoner etthundranittionio miljarder tvåhundrafemtiofyra miljoner sjuhundrafyrtio tusen niohundranittiotvå'),
+    (2 ** 53 + 1, 'nio biljarder sju biljoner etthundranittionio miljarder tvåhundrafemtiofyra miljoner sjuhundrafyrtio tusen niohundranittiotre'),
+    (10 ** 15, 'en  biljard '),
+    (-(10 ** 15) - 1, 'minus en  biljard ett'),
+    (999999999999999, 'niohundranittionio biljoner niohundranittionio miljarder niohundranittionio miljoner niohundranittionio tusen niohundranittionio'),
+]
+
+
+def check():
+    failed = 0
+    for number, expected in CHECKS:
+        for value in (number, str(number)):
+            words = to_words(value)
+            if words != expected:
+                print("to_words({!r}) = {!r}, expected {!r}".format(value, words, expected))
+                failed += 1
+    try:
+        to_words(MAX + 1)
+        print("to_words({}) didn't raise ValueError".format(MAX + 1))
+        failed += 1
+    except ValueError:
+        pass
+    print("to_words: {} checks, {} failed".format(len(CHECKS) * 2 + 1, failed))
+    return failed == 0
+
+
+def benchmark(count=100000):
+    numbers = [ str(random.randint(0, ONE_MILLION)) for _ in range(count) ]
+    to_words.cache_clear()
+    start = time.perf_counter()
+    for number in numbers:
+        to_words(number)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for number in numbers:
+        to_words(number)
+    warm = time.perf_counter() - start
+    print("to_words: {} numbers, {:.3f}s uncached ({:.2f}us/number), {:.3f}s cached ({:.2f}us/number)".format(count, cold, cold / count * 1e6, warm, warm / count * 1e6))
 
 
 if __name__ == "__main__":
-    print(to_words(sys.argv[1]))
+    if sys.argv[1] == '--benchmark':
+        benchmark()
+    elif sys.argv[1] == '--check':
+        sys.exit(0 if check() else 1)
+    else:
+        print(to_words(sys.argv[1]))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import argparse
+import mmap
+import os
+import sys
+import wave
+
+DEFAULT_SHARD_SIZE = 1 << 30 # 1 GiB
+
+HEADER = 'wav_filename,wav_filesize,shard,offset,length,sample_rate,channels,sample_width,transcript\n'
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Pack the audio of split csv files into a few large raw PCM shards')
+    parser.add_argument('files', nargs='+', help='split csv files, e.g. train.csv dev.csv test.csv')
+    parser.add_argument('--out-dir', type=str, help='directory to write shards and packed csv files to (default: packed)', default='packed')
+    parser.add_argument('--shard-size', type=int, help='max size in bytes of a shard (default: {})'.format(DEFAULT_SHARD_SIZE), default=DEFAULT_SHARD_SIZE)
+    return parser
+
+
+def read_split(file_name):
+    with open(file_name, "r") as f:
+        f.readline() # Skip header row
+        for line in f:
+            wav_file_name, file_size, text = line.rstrip('\n').split(",", 2)
+            yield wav_file_name, file_size, text
+
+
+# Writes the PCM data of every wav in csv_file to <name>-NNNNN.pcm shards in
+# out_dir, and a <name>.csv that points every row at its shard and offset
+def pack_split(csv_file, out_dir, shard_size=DEFAULT_SHARD_SIZE):
+    name = os.path.splitext(os.path.basename(csv_file))[0]
+    shard_count = 0
+    shard = None
+    shard_name = None
+    count = 0
+    out_file = os.path.join(out_dir, "{}.csv".format(name))
+    try:
+        with open(out_file, 'w') as out:
+            out.write(HEADER)
+            for wav_file_name, file_size, text in read_split(csv_file):
+                with wave.open(wav_file_name, 'rb') as wav:
+                    params = wav.getparams()
+                    frames = wav.readframes(params.nframes)
+                if shard is None or (shard.tell() > 0 and shard.tell() + len(frames) > shard_size):
+                    if shard:
+                        shard.close()
+                    shard_name = "{}-{:05d}.pcm".format(name, shard_count)
+                    shard = open(os.path.join(out_dir, shard_name), 'wb')
+                    shard_count += 1
+                out.write("{},{},{},{},{},{},{},{},{}\n".format(wav_file_name, file_size, shard_name, shard.tell(), len(frames), params.framerate, params.nchannels, params.sampwidth, text))
+                shard.write(frames)
+                count += 1
+    finally:
+        if shard:
+            shard.close()
+    print("Packed {} files from {} into {} shards, csv: {}".format(count, csv_file, shard_count, out_file))
+    return out_file
+
+
+# Reads utterances from the shards written by pack_split. Shards are memory
+# mapped and utterances are returned as memoryview slices, so nothing is
+# copied until the data is used.
+class PackedAudio:
+    def __init__(self, csv_file):
+        self.directory = os.path.dirname(csv_file)
+        self.entries = {}
+        self.shards = {}
+        with open(csv_file, "r") as f:
+            f.readline() # Skip header row
+            for line in f:
+                row = line.rstrip('\n').split(",", 8)
+                self.entries[row[0]] = (row[2], int(row[3]), int(row[4]), int(row[5]), int(row[6]), int(row[7]))
+
+    def _shard(self, shard_name):
+        if shard_name not in self.shards:
+            with open(os.path.join(self.directory, shard_name), 'rb') as f:
+                self.shards[shard_name] = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.shards[shard_name]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, wav_file_name):
+        return wav_file_name in self.entries
+
+    # Raw PCM bytes of wav_file_name
+    def __getitem__(self, wav_file_name):
+        shard_name, offset, length = self.entries[wav_file_name][:3]
+        return self._shard(shard_name)[offset:offset + length]
+
+    # Sample rate, channels and sample width (bytes) of wav_file_name
+    def params(self, wav_file_name):
+        return self.entries[wav_file_name][3:]
+
+
+def main(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    for csv_file in args.files:
+        pack_split(csv_file, args.out_dir, shard_size=args.shard_size)
+
+
+if __name__ == "__main__":
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import process_spl
+
+DEFAULT_STATE = '.pipeline-state.json'
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# One step of the pipeline. inputs are files, or glob patterns (containing
+# '*') for whole trees, outputs are files. A stage runs after every stage
+# that has one of its inputs as an output. options are appended to the
+# command but don't change the outputs (e.g. --jobs), so they aren't hashed.
+# input_key(file_name) is what is hashed for every file matched by a glob
+# pattern, by default its size and mtime.
+class Stage:
+    def __init__(self, name, command, inputs, outputs, params=None, options=None, input_key=None):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.options = options or []
+        self.input_key = input_key or file_key
+
+
+def file_key(file_name):
+    stat = os.stat(file_name)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Run the whole processing pipeline, skipping stages whose inputs and parameters haven\'t changed')
+    parser.add_argument('stages', nargs='*', help='stages to run, together with the stages they depend on (default: all)')
+    parser.add_argument('--jobs', type=int, help='number of stages to run at the same time (default: 2)', default=2)
+    parser.add_argument('--workers', type=int, help='number of worker processes used within each stage (default: 1)', default=1)
+    parser.add_argument('--seed', type=int, help='seed passed to split_dataset.py (default: search for one)')
+    parser.add_argument('--split', nargs='+', type=str, help='split sizes passed to split_dataset.py (default: 0.6 0.2 0.2)', default=['0.6', '0.2', '0.2'])
+    parser.add_argument('--skip-region', help='passed to split_dataset.py, do not check region of youth', action='store_true')
+    parser.add_argument('--skip-gender', help='passed to split_dataset.py, do not check gender', action='store_true')
+    parser.add_argument('--force', help='run stages even if their inputs haven\'t changed', action='store_true')
+    parser.add_argument('--state', type=str, help='path of file storing the hashes of the last runs (default: {})'.format(DEFAULT_STATE), default=DEFAULT_STATE)
+    parser.add_argument('--list', help='list the stages and exit', action='store_true')
+    return parser
+
+
+def build_stages(args):
+    python = sys.executable
+    script = lambda name: os.path.join(SCRIPT_DIR, name)
+    jobs = ['--jobs', str(args.workers)]
+    split_args = ['--split'] + args.split + (['--seed', str(args.seed)] if args.seed else [])
+    split_args += (['--skip-region'] if args.skip_region else []) + (['--skip-gender'] if args.skip_gender else [])
+    # The csv files also depend on the wav files of every spl file, adding,
+    # removing or replacing them changes the mtime of their speech folder,
+    # which process_spl.cache_key includes
+    return [
+        Stage('process_spl_train',
+              [python, script('process_spl.py'), '--pattern', './train/**/*/*.spl', '--out', 'all-train.csv', '--cache', 'spl-cache-train.pickle'],
+              ['./train/**/*/*.spl'], ['all-train.csv'], options=jobs, input_key=process_spl.cache_key),
+        Stage('process_spl_test',
+              [python, script('process_spl.py'), '--pattern', './test/**/*/*.spl', '--out', 'all-test.csv', '--cache', 'spl-cache-test.pickle'],
+              ['./test/**/*/*.spl'], ['all-test.csv'], options=jobs, input_key=process_spl.cache_key),
+        Stage('mono_train',
+              [python, script('mono.py'), 'train'],
+              ['all-train.csv'], ['all-train.csv.mono-journal'], options=jobs),
+        Stage('mono_test',
+              [python, script('mono.py'), 'test'],
+              ['all-test.csv'], ['all-test.csv.mono-journal'], options=jobs),
+        Stage('split_dataset',
+              [python, script('split_dataset.py'), '--file', 'all-train.csv'] + split_args,
+              ['all-train.csv', 'all-train.csv.mono-journal'], ['train.csv', 'dev.csv', 'test.csv'],
+              params={'TH_GENDER': os.environ.get('TH_GENDER'), 'TH_DURATION': os.environ.get('TH_DURATION'), 'TH_REGION': os.environ.get('TH_REGION'), 'DEFAULT_SEED': os.environ.get('DEFAULT_SEED')},
+              options=jobs),
+        Stage('corpus',
+              [python, script('nst_to_corpus.py'), 'train.csv', 'corpus.txt'],
+              ['train.csv'], ['corpus.txt'], options=jobs),
+    ]
+
+
+def hash_file(hasher, file_name):
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+
+
+# Paths of script and every module in SCRIPT_DIR it imports, directly or
+# through other modules, sorted. Imports inside functions count too.
+def local_modules(script):
+    found = set()
+    todo = [script]
+    while todo:
+        path = todo.pop()
+        if path in found:
+            continue
+        found.add(path)
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [ alias.name for alias in node.names ]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = os.path.join(SCRIPT_DIR, name.split('.')[0] + '.py')
+                if os.path.exists(module):
+                    todo.append(module)
+    return sorted(found)
+
+
+# Hash of everything a stage depends on: its script and the local modules it
+# imports, arguments, parameters and inputs.
+# Files are hashed by content. Trees (glob patterns) are hashed by the path
+# and input_key (size and mtime by default) of every file, reading every spl
+# file would take longer than parsing them.
+def stage_hash(stage):
+    hasher = hashlib.sha256()
+    for module in local_modules(stage.command[1]):
+        hasher.update(os.path.basename(module).encode('utf-8'))
+        hash_file(hasher, module)
+    hasher.update(json.dumps([stage.command[2:], stage.params]).encode('utf-8'))
+    for pattern in stage.inputs:
+        hasher.update(pattern.encode('utf-8'))
+        if '*' in pattern:
+            for file_name in sorted(glob.glob(pattern, recursive=True)):
+                hasher.update("{}\0{}\n".format(file_name, stage.input_key(file_name)).encode('utf-8'))
+        elif os.path.exists(pattern):
+            hash_file(hasher, pattern)
+        else:
+            hasher.update(b'missing')
+    return hasher.hexdigest()
+
+
+def dependencies(stages):
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            producers[output] = stage.name
+    return { stage.name: set(producers[i] for i in stage.inputs if i in producers and producers[i] != stage.name) for stage in stages }
+
+
+def select_stages(stages, names, deps):
+    if not names:
+        return stages
+    unknown = set(names) - set(stage.name for stage in stages)
+    if unknown:
+        print("Unknown stages: {}".format(', '.join(sorted(unknown))))
+        sys.exit(1)
+    selected = set()
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(deps[name])
+    return [ stage for stage in stages if stage.name in selected ]
+
+
+def load_state(file_name):
+    try:
+        with open(file_name, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(file_name, state):
+    tmp_file = file_name + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, file_name)
+
+
+def run_stage(stage):
+    start = time.time()
+    log_file = "pipeline-{}.log".format(stage.name)
+    with open(log_file, 'w') as log:
+        code = subprocess.call(stage.command + stage.options, stdout=log, stderr=subprocess.STDOUT)
+    return code, time.time() - start, log_file
+
+
+# Runs stages as soon as every stage they depend on is done, up to jobs at a
+# time. A stage is skipped when its hash matches the last successful run and
+# its outputs still exist. Hashes are computed when a stage becomes ready, so
+# the outputs of earlier stages are taken into account.
+def run_pipeline(stages, deps, state, state_file, jobs=2, force=False):
+    pending = { stage.name: stage for stage in stages }
+    done = set(name for name in deps if name not in pending)
+    failed = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if len(running) >= jobs:
+                    break
+                if deps[name] & failed:
+                    print("Skipping {}, a stage it depends on failed".format(name))
+                    failed.add(name)
+                    del pending[name]
+                    continue
+                if not deps[name] <= done:
+                    continue
+                del pending[name]
+                digest = stage_hash(stage)
+                if not force and state.get(name) == digest and all(os.path.exists(output) for output in stage.outputs):
+                    print("Skipping {}, inputs and parameters unchanged".format(name))
+                    done.add(name)
+                    continue
+                print("Running {}: {}".format(name, ' '.join([os.path.basename(stage.command[1])] + stage.command[2:] + stage.options)))
+                running[executor.submit(run_stage, stage)] = (stage, digest)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, digest = running.pop(future)
+                code, seconds, log_file = future.result()
+                if code == 0:
+                    print("Finished {} in {:.1f}s".format(stage.name, seconds))
+                    state[stage.name] = digest
+                    save_state(state_file, state)
+                    done.add(stage.name)
+                else:
+                    print("Failed {} with exit code {}, see {}".format(stage.name, code, log_file))
+                    failed.add(stage.name)
+    return not failed
+
+
+def main(args):
+    stages = build_stages(args)
+    deps = dependencies(stages)
+    if args.list:
+        for stage in stages:
+            print("{:<20} after: {}".format(stage.name, ', '.join(sorted(deps[stage.name])) or '-'))
+        return
+    stages = select_stages(stages, args.stages, deps)
+    state = load_state(args.state)
+    if not run_pipeline(stages, deps, state, args.state, jobs=args.jobs, force=args.force):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -1,6 +1,13 @@
+import argparse
 import glob
 import os.path
-import subprocess
+import pickle
+import sys
+from multiprocessing import Pool
+
+import instrument
+from manifest import Manifest, binary_file_name, parse_line, write_binary
+import wav_probe
 
 
 BAD_FILES = [
@@ -8,7 +15,8 @@ BAD_FILES = [
     './train/Stasjon6/060799/adb_0467/speech/scr0467/06/04670605/r4670479/u0479151.wav'
 ]
 
-DEV_NULL = open(os.devnull, 'w')
+# Bump when the cached tuple returned by process() changes shape
+CACHE_VERSION = 1
 
 
 def parse(line):
@@ -62,13 +70,72 @@ def parse_metadata(line):
     return key, value
 
 
-def process(file_name):
-    sentences = []
-    not_found = []
+# Speaker IDs are sometimes marked with # § or ¨, without them the same
+# speaker gets the same ID everywhere
+def clean_speaker_id(speaker_id):
+    speaker_id = speaker_id.strip().replace('#', '')
+    speaker_id = speaker_id.strip().replace('§', '')
+    speaker_id = speaker_id.strip().replace('¨', '')
+    return speaker_id
+
+
+def get_speech_folder(file_name):
     speech_folder = file_name
     speech_folder = speech_folder[:-4] # Removes .spl
     speech_folder = speech_folder + "/"
     speech_folder = speech_folder.replace("data", "speech", 1)
+    return speech_folder
+
+
+# Reads only the [Info states] header of a spl file, stops reading as soon as
+# the header has been parsed
+def read_metadata(file_name):
+    metadata = {}
+    with open(file_name, encoding='latin-1') as f:
+        should_parse_metadata = False
+        for line in f:
+            line = line.strip()
+            if line == '':
+                continue
+            if line.startswith('[Info states]'):
+                should_parse_metadata = True
+                continue
+            if line.startswith('[Session]') or line.startswith('[Validation states]'):
+                if should_parse_metadata:
+                    break
+                continue
+            if should_parse_metadata:
+                key, value = parse_metadata(line)
+                if not key:
+                    print("Malformed metadata in {}".format(file_name))
+                    continue
+                metadata[key] = value
+    return metadata
+
+
+# Lists the speech folder once, file name -> file size, so that existence and
+# size checks don't need a stat call (network round-trip on NFS) per utterance
+def list_speech_folder(speech_folder):
+    files = {}
+    try:
+        with os.scandir(speech_folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files[entry.name] = entry.stat().st_size
+    except FileNotFoundError:
+        pass
+    return files
+
+
+# timers, if given, gets the time spent listing the speech folder and probing
+# wav files, see process_timed
+def process(file_name, timers=None):
+    timers = {} if timers is None else timers
+    sentences = []
+    not_found = []
+    speech_folder = get_speech_folder(file_name)
+    with instrument.timed(timers, 'list_speech_folder'):
+        speech_files = list_speech_folder(speech_folder)
     metadata = {
         'speaker_id': None,
         'age': None,
@@ -104,14 +171,15 @@ def process(file_name):
                     print(line)
                     continue
                 wav_file_name = speech_folder + wav_file
-                if not os.path.isfile(wav_file_name):
+                if wav_file not in speech_files:
                     not_found.append((wav_file_name, file_name))
                     continue
                 if wav_file_name in BAD_FILES:
                     # We only want good (non broken) sound files
                     continue
-                duration_in_seconds = float(subprocess.check_output(['soxi', '-D', wav_file_name], stderr=DEV_NULL))
-                file_size = os.path.getsize(wav_file_name)
+                with instrument.timed(timers, 'probe_wav'):
+                    duration_in_seconds = wav_probe.duration(wav_file_name)
+                file_size = speech_files[wav_file]
                 sentences.append((text, wav_file_name, duration_in_seconds, file_size))
             if should_parse_metadata:
                 key, value = parse_metadata(line)
@@ -122,19 +190,182 @@ def process(file_name):
     return sentences, not_found, metadata
 
 
-if __name__ == "__main__":
+# Returns (process(file_name), timers) where timers splits the time spent into
+# parse_spl, list_speech_folder and probe_wav, for use in worker processes
+def process_timed(file_name):
+    timers = {}
+    with instrument.timed(timers, 'parse_spl'):
+        result = process(file_name, timers)
+    timers['parse_spl'] -= timers.get('list_speech_folder', 0.0) + timers.get('probe_wav', 0.0)
+    return result, timers
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Parse NST spl files into a single csv file')
+    parser.add_argument('--jobs', type=int, help='number of worker processes used to parse spl files (default: 1)', default=1)
+    parser.add_argument('--out', type=str, help='path of output file (default: all-train.csv)', default='all-train.csv')
+    parser.add_argument('--cache', type=str, help='path of cache file used to skip unchanged spl files (default: spl-cache.pickle)', default='spl-cache.pickle')
+    parser.add_argument('--no-cache', help='parse every spl file, don\'t read or write the cache', action='store_true')
+    parser.add_argument('--binary', help='also write a binary manifest next to the output file (e.g. all-train.manifest) that split_dataset.py reads instead of the csv file', action='store_true')
+    parser.add_argument('--pattern', type=str, help='glob pattern used to find spl files (default: ./train/**/*/*.spl)', default='./train/**/*/*.spl')
+    parser.add_argument('--catalog', type=str, help='write the csv file from a catalog built by catalog.py instead of parsing spl files, --pattern is not used then')
+    parser.add_argument('--dataset', type=str, help='dataset of the catalog to write with --catalog, train or test (default: train)', default='train')
+    instrument.add_arguments(parser)
+    return parser
+
+
+# A spl file only has to be parsed again if it, or the folder holding its
+# speech files, has changed since it was cached
+def cache_key(file_name):
+    spl_stat = os.stat(file_name)
+    try:
+        speech_mtime = os.stat(get_speech_folder(file_name)).st_mtime_ns
+    except OSError:
+        speech_mtime = None
+    return (spl_stat.st_mtime_ns, spl_stat.st_size, speech_mtime)
+
+
+def load_cache(cache_file):
+    try:
+        with open(cache_file, 'rb') as f:
+            cache = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return {}
+    if cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache['entries']
+
+
+def save_cache(cache_file, entries):
+    # Write to a temporary file first so a crash never leaves a broken cache
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump({'version': CACHE_VERSION, 'entries': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+
+def process_all(file_names, jobs=1, cache=None, timers=None):
+    # Yields (sentences, not_found, metadata) in the same order as file_names,
+    # regardless of how many workers are used. If a cache dict is given, files
+    # with a matching entry are not parsed again and new entries are added.
+    # Entries of files that no longer exist are dropped, entries outside
+    # file_names are kept so runs with other patterns can share a cache. If a
+    # timers dict is given, the time the workers spent in every part of
+    # process is added to it.
+    keys = {}
+    misses = file_names
+    if cache is not None:
+        keys = { file_name: cache_key(file_name) for file_name in file_names }
+        misses = [ file_name for file_name in file_names if file_name not in cache or cache[file_name][0] != keys[file_name] ]
+        print("Reusing {} cached spl files, parsing {}".format(len(file_names) - len(misses), len(misses)))
+
+    func = process if timers is None else process_timed
+    def next_result():
+        result = next(results)
+        if timers is None:
+            return result
+        result, result_timers = result
+        for name, seconds in result_timers.items():
+            timers[name] = timers.get(name, 0.0) + seconds
+        return result
+
+    pool = Pool(jobs) if jobs > 1 and misses else None
+    try:
+        if pool:
+            results = pool.imap(func, misses, chunksize=16)
+        else:
+            results = map(func, misses)
+        for file_name in file_names:
+            if cache is None:
+                yield next_result()
+                continue
+            entry = cache.get(file_name)
+            if not entry or entry[0] != keys[file_name]:
+                entry = (keys[file_name], next_result())
+                cache[file_name] = entry
+            yield entry[1]
+    finally:
+        if pool:
+            pool.terminate()
+
+    if cache is not None:
+        for file_name in [ file_name for file_name in cache if file_name not in keys and not os.path.exists(file_name) ]:
+            del cache[file_name]
+
+
+CSV_HEADER = 'wav_filename, duration_in_seconds, file_size, speaker_id, age, sex, region_of_birth, region_of_youth, transcript\n'
+
+
+def format_line(wav_file, duration_in_seconds, file_size, metadata, text):
+    return "{}, {}, {}, {}, {}, {}, {}, {}, {}\n".format(wav_file, duration_in_seconds, file_size, metadata['speaker_id'], metadata['age'], metadata['sex'], metadata['region_of_birth'], metadata['region_of_youth'], text)
+
+
+# Writes the csv file (and binary manifest) of a dataset from the catalog,
+# the same lines as parsing its spl files when the catalog was built
+def export_catalog(args, report):
+    import catalog
+    conn = catalog.connect(args.catalog)
+    sentence_count = 0
+    binary = Manifest() if args.binary else None
+    with report.stage('export_catalog') as stage, open(args.out, 'wt') as f:
+        f.write(CSV_HEADER)
+        for row in catalog.iter_utterances(conn, args.dataset):
+            line = format_line(row['wav_file_name'], row['duration'], row['file_size'], row, row['transcript'])
+            f.write(line)
+            if binary is not None:
+                binary.append(parse_line(line))
+            sentence_count += 1
+        stage.add(sentences=sentence_count)
+    conn.close()
+    if binary is not None:
+        with report.stage('write_binary'):
+            write_binary(binary, binary_file_name(args.out))
+    print("\nTotal found sentences: {0}".format(sentence_count))
+
+
+def main(args):
+    report = instrument.Report('process_spl', progress_interval=args.progress)
+    if args.catalog:
+        export_catalog(args, report)
+        if args.report:
+            report.save(args.report)
+        return
     sentence_count = 0
     not_found_count = 0
-    with open('all-train.csv', 'wt') as f:
-        f.write('wav_filename, duration_in_seconds, file_size, speaker_id, age, sex, region_of_birth, region_of_youth, transcript\n')
-        for file_name in glob.glob("./train/**/*/*.spl", recursive=True):
-            sentences, not_found, metadata = process(file_name)
+    with report.stage('find_spl_files') as stage:
+        file_names = glob.glob(args.pattern, recursive=True)
+        stage.add(len(file_names))
+    with report.stage('load_cache'):
+        cache = None if args.no_cache else load_cache(args.cache)
+    binary = Manifest() if args.binary else None
+    with report.stage('process_spl', total=len(file_names)) as stage, open(args.out, 'wt') as f:
+        f.write(CSV_HEADER)
+        for sentences, not_found, metadata in process_all(file_names, jobs=args.jobs, cache=cache, timers=stage.timers):
             sentence_count += len(sentences)
             not_found_count += len(not_found)
-            for (text, wav_file, duration_in_seconds, file_size) in sentences:
-                if wav_file not in BAD_FILES:
-                    # We only want good (non broken) sound files
-                    f.write("{}, {}, {}, {}, {}, {}, {}, {}, {}\n".format(wav_file, duration_in_seconds, file_size, metadata['speaker_id'], metadata['age'], metadata['sex'], metadata['region_of_birth'], metadata['region_of_youth'], text))
+            with stage.timer('write_csv'):
+                for (text, wav_file, duration_in_seconds, file_size) in sentences:
+                    if wav_file not in BAD_FILES:
+                        # We only want good (non broken) sound files
+                        line = format_line(wav_file, duration_in_seconds, file_size, metadata, text)
+                        f.write(line)
+                        if binary is not None:
+                            # Parsed back from the line so both files hold the same values
+                            binary.append(parse_line(line))
             for (wav_file_name, file_name) in not_found:
                 print("Speech file not found in:\n\t{0}\nas defined in:\n\t{1}\n==================================".format(wav_file_name, file_name))
+            stage.add(sentences=len(sentences), not_found=len(not_found))
+    if binary is not None:
+        with report.stage('write_binary'):
+            write_binary(binary, binary_file_name(args.out))
+    if cache is not None:
+        with report.stage('save_cache'):
+            save_cache(args.cache, cache)
     print("\nTotal found sentences: {0}\nTotal not found: {1}".format(sentence_count, not_found_count))
+    if args.report:
+        report.save(args.report)
+
+
+if __name__ == "__main__":
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -1,25 +1,78 @@
-import os
+import argparse
 import csv
+import os
+import shutil
 import sys
-import subprocess
+import tempfile
+from itertools import islice
+from multiprocessing import Pool
 from util import normalize
+import instrument
+import wav_probe
+
+BATCH_SIZE = 1024
+
+
+def load_arg_parser():
+    parser = argparse.ArgumentParser(description='Normalize transcripts of a tts csv file in place, dropping clips of 10 seconds or more')
+    parser.add_argument('file', type=str, help='path of csv file to process')
+    parser.add_argument('--jobs', type=int, help='number of worker processes used to probe and normalize rows (default: 1)', default=1)
+    instrument.add_arguments(parser)
+    return parser
+
+
+# Returns the row to write, or None if the row should be dropped
+def process_row(row):
+    if (row[0].endswith(".mp3")):
+        row[0] = "./" + row[0][:-4] + ".wav"
+    duration_in_seconds = wav_probe.duration(row[0])
+    if duration_in_seconds < 10.0:
+        normalized = normalize(row[2])
+        if normalized.strip() != '':
+            return [row[0], row[1], normalized]
+    return None
+
+
+# Yields processed rows in input order. Rows are read and handed to the
+# workers one batch at a time, so memory use doesn't grow with the file.
+def process_rows(rows, jobs=1, stage=None):
+    pool = Pool(jobs) if jobs > 1 else None
+    try:
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            results = pool.map(process_row, batch) if pool else list(map(process_row, batch))
+            if stage:
+                stage.add(len(batch), kept=sum(1 for row in results if row))
+            for row in results:
+                if row:
+                    yield row
+    finally:
+        if pool:
+            pool.terminate()
+
+
+def main(args):
+    report = instrument.Report('process_tts', progress_interval=args.progress)
+    # Write to a temporary file next to the input and replace the input only
+    # when every row is done, a crash leaves the input untouched
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(args.file)), suffix='.tmp')
+    try:
+        with report.stage('process_rows') as stage, open(args.file, "r") as input_file, os.fdopen(fd, "w") as output_file:
+            writer = csv.writer(output_file)
+            for row in process_rows(csv.reader(input_file), jobs=args.jobs, stage=stage):
+                writer.writerow(row)
+        # mkstemp creates the file readable by the owner only, keep the mode of the input
+        shutil.copymode(args.file, tmp_file)
+        os.replace(tmp_file, args.file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    if args.report:
+        report.save(args.report)
 
-DEV_NULL = open(os.devnull, 'w')
 
 if __name__ == "__main__":
-    rows = []
-    with open(sys.argv[1], "r") as input_file:
-        input_csv = csv.reader(input_file)
-        for row in input_csv:
-            rows.append(row)
-
-    with open(sys.argv[1], "w") as input_file:
-        writer = csv.writer(input_file)
-        for row in rows:
-            if (row[0].endswith(".mp3")):
-                row[0] = "./" + row[0][:-4] + ".wav"
-            duration_in_seconds = float(subprocess.check_output(['soxi', '-D', row[0]], stderr=DEV_NULL))
-            if duration_in_seconds < 10.0:
-                normalized = normalize(row[2])
-                if normalized.strip() != '':
-                    writer.writerow([row[0], row[1], normalized])
+    args_parser = load_arg_parser()
+    main(args_parser.parse_args(sys.argv[1:]))
@@ -1,15 +1,37 @@
 import sys
 import random
 import argparse
+import hashlib
 import os
+import pickle
+import time
+from array import array
 from collections import Counter
+from multiprocessing import Pool
 from util import normalize
+from process_spl import clean_speaker_id
+from manifest import BinaryWriter, Categorical, Manifest, PROCESSED_COLUMNS, RAW_COLUMNS, binary_file, binary_file_name, load_manifest, open_binary, parse_line, parse_processed_line, write_binary
+import instrument
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 DEFAULT_SEED = int(os.environ.get('DEFAULT_SEED', 1337))
 TH_GENDER = float(os.environ.get('TH_GENDER', 0.001))
 TH_DURATION = float(os.environ.get('TH_DURATION', 0.001))
 TH_REGION = float(os.environ.get('TH_REGION', 0.1))
 
+# Seconds between "Tried N seeds" lines of the seed search, --progress
+# overrides it
+SEARCH_PROGRESS_INTERVAL = 10.0
+
+# Bump when the format of cache entries changes, the source of the code
+# building them is part of the cache key already
+FIXED_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = 'split-cache'
+
 BAD_SOUND_FILES = [
     './train/Stasjon3/280799/adb_0467/speech/scr0467/03/04670303/r4670265/u0265070.wav',
     './train/Stasjon6/060799/adb_0467/speech/scr0467/06/04670605/r4670479/u0479151.wav',
@@ -41,6 +63,16 @@ def load_arg_parser():
     parser.add_argument('--skip-gender', help='do not check gender', action='store_true')
     parser.add_argument('--skip-speaker', help='do not check speaker ID', action='store_true')
     parser.add_argument('--any-duration', help='allow any duration of sound clips', action='store_true')
+    parser.add_argument('--solver', help='build a balanced split directly with greedy assignment and local search instead of searching for a seed', action='store_true')
+    parser.add_argument('--solver-iterations', type=int, help='max number of local search iterations used by --solver (default: 200000)', default=200000)
+    parser.add_argument('--accept-unbalanced', help='with --solver, write the assignment and split files even if no balanced split was found (default: exit with an error)', action='store_true')
+    parser.add_argument('--assignment', type=str, help='path of a speaker assignment file (written by --solver) to reuse instead of splitting')
+    parser.add_argument('--streaming', help='read the input file twice instead of keeping it in memory, memory use then depends on the number of speakers instead of rows', action='store_true')
+    parser.add_argument('--jobs', type=int, help='number of worker processes used when searching for a seed (default: 1)', default=1)
+    parser.add_argument('--binary', help='also write a binary manifest next to every split file (e.g. train.manifest)', action='store_true')
+    parser.add_argument('--cache-dir', type=str, help='directory caching fixed data and speaker stats by input file and flags (default: {})'.format(DEFAULT_CACHE_DIR), default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--no-cache', help='don\'t read or write the fixed data cache', action='store_true')
+    instrument.add_arguments(parser)
     return parser
 
 def load_train():
@@ -52,68 +84,123 @@ def load_test():
 
 
 def _load_data(file_name):
-    all_data = []
+    return list(_iter_data(file_name))
+
+
+# Yields one row at a time, so a large file never has to fit in memory. Reads
+# the binary manifest written by process_spl.py --binary if there is one.
+def _iter_data(file_name):
+    binary = binary_file(file_name)
+    if binary:
+        yield from open_binary(binary)
+        return
+    names = [ name for name, _ in RAW_COLUMNS ]
     with open(file_name, "r") as f:
         f.readline() # Skip header row
         for line in f:
-            row = line.split(",")
-            data = {
-                'wav_file_name': row[0].strip(),
-                'duration': float(row[1].strip()),
-                'file_size': int(row[2].strip()),
-                'speaker_id': row[3].strip(),
-                'age': row[4].strip(),
-                'sex': row[5].strip(),
-                'region_of_birth': row[6].strip(),
-                'region_of_youth': row[7].strip(),
-                'text': ', '.join(row[8:]).strip()
-            }
-            all_data.append(data)
-    return all_data
+            yield dict(zip(names, parse_line(line)))
 
 
 # Filters every item according to some filter functions defined
-def filter_text(text):
-    filter_functions = [
-        lambda x: x == '( ... tyst under denna inspelning ...)',
-        lambda x: "è" in x,
-        lambda x: "ü" in x,
-        lambda x: "î" in x,
-        lambda x: "ÿ" in x
-    ]
-    for func in filter_functions:
-        if (func(text)):
-            return True
-    return False
+TEXT_FILTERS = [
+    ('silent recording', lambda x: x == '( ... tyst under denna inspelning ...)'),
+    ('contains è', lambda x: "è" in x),
+    ('contains ü', lambda x: "ü" in x),
+    ('contains î', lambda x: "î" in x),
+    ('contains ÿ', lambda x: "ÿ" in x)
+]
 
 
-def fix_data(data_list, skip_speaker_id=False, any_duration=False):
-    new_data = []
+def filter_text(text):
+    return filter_text_reason(text) is not None
 
+
+def filter_text_reason(text):
+    for reason, func in TEXT_FILTERS:
+        if (func(text)):
+            return reason
+    return None
+
+
+# Why fix_data drops data, or None if it is kept
+def filter_reason(data, any_duration=False):
+    if not any_duration and data['duration'] >= 10.0:
+        return 'too long'
+    if data['speaker_id'].strip() == '':
+        return 'no speaker id'
+    reason = filter_text_reason(data['text'])
+    if reason:
+        return reason
+    if data['wav_file_name'] in BAD_SOUND_FILES:
+        return 'bad sound file'
+    return None
+
+
+# timers, if given, gets the time spent filtering rows and normalizing text
+def fix_data(data_list, skip_speaker_id=False, any_duration=False, timers=None):
+    if isinstance(data_list, Manifest):
+        return fix_manifest(data_list, skip_speaker_id=skip_speaker_id, any_duration=any_duration, timers=timers)
+    return list(iter_fixed_data(data_list, skip_speaker_id=skip_speaker_id, any_duration=any_duration, timers=timers))
+
+
+# fix_data for a Manifest, works on the columns and returns a new Manifest.
+# Speaker IDs are cleaned once per distinct ID instead of once per row.
+def fix_manifest(manifest, skip_speaker_id=False, any_duration=False, normalize_text=True, timers=None):
+    timers = {} if timers is None else timers
+    durations = manifest.column('duration')
+    speakers = manifest.column('speaker_id')
+    texts = manifest.column('text')
+    wav_file_names = manifest.column('wav_file_name')
+
+    with instrument.timed(timers, 'filter'):
+        keep = array('I')
+        # Only the fields filter_reason looks at, one dict reused for every row
+        row = {}
+        for i, speaker_id in enumerate(speakers):
+            row['duration'] = durations[i]
+            row['speaker_id'] = speaker_id
+            row['text'] = texts[i]
+            row['wav_file_name'] = wav_file_names[i]
+            if not filter_reason(row, any_duration=any_duration):
+                keep.append(i)
+        fixed = manifest.take(keep)
+
+    fixed.columns['speaker_id'] = fixed.columns['speaker_id'].map(clean_speaker_id)
+    if skip_speaker_id:
+        # We don't care about distributing by speaker ID, so make every ID unique
+        speakers = fixed.columns['speaker_id']
+        unique = Categorical()
+        for speaker_id, i in zip(speakers, keep):
+            unique.append(speaker_id + str(i))
+        fixed.columns['speaker_id'] = unique
+    if normalize_text:
+        with instrument.timed(timers, 'normalize'):
+            fixed.columns['text'] = [ normalize(text, is_nst=True) for text in fixed.columns['text'] ]
+    return fixed
+
+
+# Generator version of fix_data, normalize_text=False skips normalizing the
+# transcripts when only the speaker stats are needed
+def iter_fixed_data(data_list, skip_speaker_id=False, any_duration=False, normalize_text=True, timers=None):
+    timers = {} if timers is None else timers
     for i, data in enumerate(data_list):
-        if not any_duration and data['duration'] >= 10.0:
-            continue
-        if data['speaker_id'].strip() == '':
-            continue
-        if filter_text(data['text']):
-            continue
-        if data['wav_file_name'] in BAD_SOUND_FILES:
+        if filter_reason(data, any_duration=any_duration):
             continue
 
-        data['speaker_id'] =  data['speaker_id'].strip().replace('#', '')
-        data['speaker_id'] =  data['speaker_id'].strip().replace('§', '')
-        data['speaker_id'] =  data['speaker_id'].strip().replace('¨', '')
+        data['speaker_id'] = clean_speaker_id(data['speaker_id'])
         if skip_speaker_id:
             # We don't care about distributing by speaker ID, so make every ID unique
             data['speaker_id'] = data['speaker_id'] + str(i)
 
-        data['text'] = normalize(data['text'], is_nst=True)
-        new_data.append(data)
-
-    return new_data
+        if normalize_text:
+            with instrument.timed(timers, 'normalize'):
+                data['text'] = normalize(data['text'], is_nst=True)
+        yield data
 
 
 def build_speaker_stats(data_list):
+    if isinstance(data_list, Manifest):
+        return _build_manifest_speaker_stats(data_list)
     stats = {}
     for data in data_list:
         speaker = data['speaker_id']
@@ -128,6 +215,90 @@ def build_speaker_stats(data_list):
     return stats
 
 
+# build_speaker_stats for a Manifest, sums the duration and file size columns
+# by speaker code. Like for rows, age, sex and region are taken from the last
+# row of every speaker and speakers are in order of first appearance.
+def _build_manifest_speaker_stats(manifest):
+    speakers = manifest.column('speaker_id')
+    durations = manifest.column('duration')
+    file_sizes = manifest.column('file_size')
+    categories = [ manifest.column(name) for name in ['age', 'sex', 'region_of_youth'] ]
+    totals = {}
+    last_row = {}
+    for i, code in enumerate(speakers.codes):
+        total = totals.get(code)
+        if total is None:
+            total = totals[code] = [0.0, 0, 0]
+        total[0] += durations[i]
+        total[1] += file_sizes[i]
+        total[2] += 1
+        last_row[code] = i
+
+    stats = {}
+    for code, (duration, file_size, rows) in totals.items():
+        i = last_row[code]
+        stats[speakers.values[code]] = {
+            'duration': duration,
+            'file_size': file_size,
+            'rows': rows,
+            'age': categories[0][i],
+            'sex': categories[1][i],
+            'region_of_youth': categories[2][i]
+        }
+    return stats
+
+
+# Speaker stats as a matrix, one row per speaker and the columns duration,
+# file size, rows and one column per age, sex and region of youth value
+# holding the speaker's row count. Stats for a set of speakers is then a
+# single sum over the selected rows.
+class SpeakerMatrix:
+    CATEGORIES = ['age', 'sex', 'region_of_youth']
+
+    def __init__(self, speaker_stats):
+        self.index = { speaker: i for i, speaker in enumerate(speaker_stats) }
+        self.values = {}
+        self.offsets = {}
+        width = 3
+        for key in self.CATEGORIES:
+            self.values[key] = sorted(set(stats[key] for stats in speaker_stats.values()))
+            self.offsets[key] = width
+            width += len(self.values[key])
+
+        self.matrix = np.zeros((len(speaker_stats), width))
+        for i, stats in enumerate(speaker_stats.values()):
+            self.matrix[i, 0] = stats['duration']
+            self.matrix[i, 1] = stats['file_size']
+            self.matrix[i, 2] = stats['rows']
+            for key in self.CATEGORIES:
+                self.matrix[i, self.offsets[key] + self.values[key].index(stats[key])] = stats['rows']
+        self.totals = self.matrix.sum(axis=0)
+
+    # Same format as the dicts built by check_balance.get_stats
+    def get_stats(self, speakers=None):
+        if speakers is None:
+            sums = self.totals
+        else:
+            rows = np.fromiter((self.index[speaker] for speaker in speakers), dtype=np.intp, count=len(speakers))
+            sums = self.matrix[rows].sum(axis=0)
+        stats = {
+            'duration':     float(sums[0]),
+            'file_size':    int(sums[1])
+        }
+        for key in self.CATEGORIES:
+            offset = self.offsets[key]
+            stats[key] = { value: int(sums[offset + i]) for i, value in enumerate(self.values[key]) if sums[offset + i] }
+        return stats
+
+
+# Returns None if NumPy isn't installed, check_balance then falls back to
+# computing the stats from the speaker stats dicts
+def build_speaker_matrix(speaker_stats):
+    if np is None:
+        return None
+    return SpeakerMatrix(speaker_stats)
+
+
 def distribute_speakers(speaker_stats, split, seed):
     random.seed(seed)
 
@@ -160,16 +331,16 @@ def distribute_speakers(speaker_stats, split, seed):
 
 # Returns the largest difference between the items provided
 def maxdiff(*stats):
-    stats = [stat for stat in stats if stat]
+    stats = [stat for stat in stats if stat is not None]
     return max(stats) - min(stats)
 
 
 # Like max(), but ignores None
 def max_v2(data):
-    return max([ val for val in data if val ])
+    return max([ val for val in data if val is not None ])
 
 
-def check_balance(speaker_stats, train, dev, test, split, skip_region, skip_gender, verbose=False, early_exit=False):
+def check_balance(speaker_stats, train, dev, test, split, skip_region, skip_gender, verbose=False, early_exit=False, matrix=None):
     balanced = True
     def get_stats(data):
         ages = {}
@@ -198,26 +369,45 @@ def check_balance(speaker_stats, train, dev, test, split, skip_region, skip_gend
 
     if verbose:
         print("Calcluating stats...")
-    all_stats = get_stats([ stat for _, stat in speaker_stats.items() ])
-    train_stats = get_stats([ stat for speaker, stat in speaker_stats.items() if speaker in train ])
-    dev_stats = get_stats([ stat for speaker, stat in speaker_stats.items() if speaker in dev ])
     test_stats = None
-    if test:
-        test_stats = get_stats([ stat for speaker, stat in speaker_stats.items() if speaker in test ])
+    if matrix is not None:
+        all_stats = matrix.get_stats()
+        train_stats = matrix.get_stats(train)
+        dev_stats = matrix.get_stats(dev)
+        if test:
+            test_stats = matrix.get_stats(test)
+    else:
+        all_stats = get_stats([ stat for _, stat in speaker_stats.items() ])
+        train_stats = get_stats([ speaker_stats[speaker] for speaker in train ])
+        dev_stats = get_stats([ speaker_stats[speaker] for speaker in dev ])
+        if test:
+            test_stats = get_stats([ speaker_stats[speaker] for speaker in test ])
 
     if verbose and not skip_gender:
         print("Checking gender balance, threshold: {}".format(TH_GENDER))
 
+    # A set without any speaker of a sex or region counts as 0 of it, and a
+    # set without any Male or Female rows as infinitely far off, so both are
+    # unbalanced instead of failing with a KeyError or ZeroDivisionError
     def gender_difference(stats):
-        male = stats['Male'] / (stats['Male'] + stats['Female'])
-        female = stats['Female'] / (stats['Male'] + stats['Female'])
+        count = stats.get('Male', 0) + stats.get('Female', 0)
+        if count == 0:
+            return None
+        male = stats.get('Male', 0) / count
+        female = stats.get('Female', 0) / count
         return abs(male - female)
 
+    def gender_diff_from_total(stats, total_gender_diff):
+        diff = gender_difference(stats)
+        if diff is None or total_gender_diff is None:
+            return float('inf')
+        return abs(diff - total_gender_diff)
+
     if not skip_gender:
         total_gender_diff = gender_difference(all_stats['sex'])
-        train_gender_diff = abs(gender_difference(train_stats['sex']) - total_gender_diff)
-        dev_gender_diff = abs(gender_difference(dev_stats['sex']) - total_gender_diff)
-        test_gender_diff = abs(gender_difference(test_stats['sex']) - total_gender_diff) if test else None
+        train_gender_diff = gender_diff_from_total(train_stats['sex'], total_gender_diff)
+        dev_gender_diff = gender_diff_from_total(dev_stats['sex'], total_gender_diff)
+        test_gender_diff = gender_diff_from_total(test_stats['sex'], total_gender_diff) if test else None
 
         if max_v2([train_gender_diff, dev_gender_diff, test_gender_diff]) >= TH_GENDER:
             if verbose:
@@ -263,10 +453,14 @@ def check_balance(speaker_stats, train, dev, test, split, skip_region, skip_gend
     if test:
         total_region_count += test_region_count
 
+    # An empty set has none of any region
+    def region_part(stats, location, region_count):
+        return stats['region_of_youth'].get(location, 0)/region_count if region_count else 0.0
+
     for location, count in all_stats['region_of_youth'].items():
-        train_part = train_stats['region_of_youth'][location]/train_region_count
-        dev_part = dev_stats['region_of_youth'][location]/dev_region_count
-        test_part = test_stats['region_of_youth'][location]/test_region_count if test else None
+        train_part = region_part(train_stats, location, train_region_count)
+        dev_part = region_part(dev_stats, location, dev_region_count)
+        test_part = region_part(test_stats, location, test_region_count) if test else None
         train_diff = train_part / (all_stats['region_of_youth'][location]/total_region_count)
         dev_diff = dev_part / (all_stats['region_of_youth'][location]/total_region_count)
         test_diff = test_part / (all_stats['region_of_youth'][location]/total_region_count) if test else None
@@ -285,7 +479,7 @@ def check_balance(speaker_stats, train, dev, test, split, skip_region, skip_gend
     return balanced
 
 
-def do_split(speaker_stats, split, seed, skip_region, skip_gender, verbose=False):
+def do_split(speaker_stats, split, seed, skip_region, skip_gender, verbose=False, matrix=None):
     print("*" * 80)
     print("Doing split using seed: {}".format(seed))
     if verbose:
@@ -295,13 +489,229 @@ def do_split(speaker_stats, split, seed, skip_region, skip_gender, verbose=False
     if verbose:
         print("Checking if speaker stats are balanced")
 
-    balanced = check_balance(speaker_stats, train, dev, test, split, skip_region, skip_gender, verbose=verbose)
+    balanced = check_balance(speaker_stats, train, dev, test, split, skip_region, skip_gender, verbose=verbose, matrix=matrix)
 
     return balanced, (train, dev, test)
 
 
+# State shared by the seed search workers, set once per process so that the
+# speaker stats don't have to be sent along with every seed
+_search_state = None
+
+
+def _init_search(speaker_stats, split, skip_region, skip_gender, thresholds, matrix):
+    global _search_state, TH_GENDER, TH_DURATION, TH_REGION
+    _search_state = (speaker_stats, split, skip_region, skip_gender, matrix)
+    TH_GENDER, TH_DURATION, TH_REGION = thresholds
+
+
+def _evaluate_seed(seed):
+    speaker_stats, split, skip_region, skip_gender, matrix = _search_state
+    train, dev, test = distribute_speakers(speaker_stats, split, seed)
+    return check_balance(speaker_stats, train, dev, test, split, skip_region, skip_gender, early_exit=True, matrix=matrix)
+
+
+def candidate_seeds(start_seed):
+    # Same sequence no matter how many workers are used, so the seed found is
+    # always the first balanced one in this sequence
+    rng = random.Random(start_seed)
+    yield start_seed
+    while True:
+        yield rng.randint(1, 9999999)
+
+
+def search_seed(speaker_stats, split, start_seed, skip_region, skip_gender, jobs=1, matrix=None, progress_interval=SEARCH_PROGRESS_INTERVAL):
+    init_args = (speaker_stats, split, skip_region, skip_gender, (TH_GENDER, TH_DURATION, TH_REGION), matrix)
+    seeds = candidate_seeds(start_seed)
+    batch_size = max(jobs, 1) * 16
+    tried = 0
+    last_progress = time.perf_counter()
+    pool = Pool(jobs, initializer=_init_search, initargs=init_args) if jobs > 1 else None
+    if not pool:
+        _init_search(*init_args)
+    try:
+        while True:
+            batch = [ next(seeds) for _ in range(batch_size) ]
+            results = pool.map(_evaluate_seed, batch) if pool else map(_evaluate_seed, batch)
+            for seed, balanced in zip(batch, results):
+                tried += 1
+                if balanced:
+                    print("Found balanced seed after trying {} seeds".format(tried))
+                    return seed
+            if time.perf_counter() - last_progress >= progress_interval:
+                print("Tried {} seeds without finding a balanced split".format(tried))
+                last_progress = time.perf_counter()
+    finally:
+        if pool:
+            pool.terminate()
+
+
+# Local search state for one set, the sums needed to score it
+def _new_set_state():
+    return {'duration': 0.0, 'rows': 0, 'male': 0, 'female': 0, 'regions': Counter()}
+
+
+def _add_speaker(state, stats, sign=1):
+    state['duration'] += sign * stats['duration']
+    state['rows'] += sign * stats['rows']
+    if stats['sex'] == 'Male':
+        state['male'] += sign * stats['rows']
+    elif stats['sex'] == 'Female':
+        state['female'] += sign * stats['rows']
+    state['regions'][stats['region_of_youth']] += sign * stats['rows']
+
+
+# Cost of a set missing a region or sex that is in the data. It can never be
+# balanced then, so this outweighs any other part of the cost, but it is
+# finite so that moves filling in one missing region still count as better.
+MISSING_COST = 1e12
+
+
+# Squared distance from the targets for one set, each part scaled by the
+# threshold check_balance uses for it so that they weigh the same
+def _set_cost(state, target, totals, skip_region, skip_gender):
+    if state['rows'] == 0:
+        return float('inf')
+    cost = ((state['duration'] / totals['duration'] - target) / TH_DURATION) ** 2
+    if not skip_gender:
+        if _missing_sex(state, totals):
+            cost += MISSING_COST
+        elif state['male'] + state['female'] > 0:
+            male_part = state['male'] / (state['male'] + state['female'])
+            cost += (2 * (male_part - totals['male_part']) / TH_GENDER) ** 2
+    if not skip_region:
+        for region, part in totals['region_parts'].items():
+            if state['regions'][region] <= 0:
+                cost += MISSING_COST
+            else:
+                cost += ((state['regions'][region] / state['rows'] / part - 1) / TH_REGION) ** 2
+    return cost
+
+
+def _missing_sex(state, totals):
+    return (totals['male_part'] > 0 and state['male'] <= 0) or (totals['male_part'] < 1 and state['female'] <= 0)
+
+
+# Whether the sets can pass check_balance at all, a set without every region
+# and sex of the data can't, so check_balance isn't run for those states
+def _can_check_balance(states, totals, skip_region, skip_gender):
+    for state in states:
+        if not skip_gender and _missing_sex(state, totals):
+            return False
+        if not skip_region and any(state['regions'][region] <= 0 for region in totals['region_parts']):
+            return False
+    return True
+
+
+def solve_partition(speaker_stats, split, seed, skip_region, skip_gender, iterations=200000, matrix=None):
+    rng = random.Random(seed)
+    sets = ['train', 'dev', 'test'] if split['test'] != None else ['train', 'dev']
+    targets = { name: split[name] for name in sets }
+    if split['test'] == None:
+        # Same as distribute_speakers, dev gets everything that isn't train
+        targets['dev'] = 1.0 - split['train']
+
+    total = _new_set_state()
+    for stats in speaker_stats.values():
+        _add_speaker(total, stats)
+    totals = {
+        'duration': total['duration'],
+        'male_part': total['male'] / max(total['male'] + total['female'], 1),
+        'region_parts': { region: rows / total['rows'] for region, rows in total['regions'].items() if rows }
+    }
+
+    # Greedy start, per region of youth like distribute_speakers: longest
+    # speakers first, each to a set that has no speaker from the region yet,
+    # otherwise to the set furthest below its share of the region's duration
+    speakers = list(speaker_stats)
+    rng.shuffle(speakers)
+    speakers.sort(key=lambda speaker: speaker_stats[speaker]['duration'], reverse=True)
+    speakers_by_region = {}
+    for speaker in speakers:
+        speakers_by_region.setdefault(speaker_stats[speaker]['region_of_youth'], []).append(speaker)
+    states = { name: _new_set_state() for name in sets }
+    assignment = {}
+    for region_speakers in speakers_by_region.values():
+        region_states = { name: _new_set_state() for name in sets }
+        for speaker in region_speakers:
+            duration = speaker_stats[speaker]['duration']
+            name = min(sets, key=lambda name: (region_states[name]['rows'] > 0, (region_states[name]['duration'] + duration) / targets[name]))
+            assignment[speaker] = name
+            _add_speaker(states[name], speaker_stats[speaker])
+            _add_speaker(region_states[name], speaker_stats[speaker])
+
+    def cost_of(name):
+        return _set_cost(states[name], targets[name], totals, skip_region, skip_gender)
+
+    # Local search: move a random speaker to another set, or swap it with a
+    # random speaker from that set, whenever that lowers the cost
+    members = { name: [ speaker for speaker in speakers if assignment[speaker] == name ] for name in sets }
+    costs = { name: cost_of(name) for name in sets }
+    for iteration in range(iterations):
+        if iteration % 5000 == 0 and _can_check_balance(states.values(), totals, skip_region, skip_gender):
+            partition = tuple(members[name] for name in sets) + ((None,) if len(sets) == 2 else ())
+            if check_balance(speaker_stats, *partition, split, skip_region, skip_gender, early_exit=True, matrix=matrix):
+                print("Solver found balanced split after {} iterations".format(iteration))
+                break
+
+        speaker = rng.choice(speakers)
+        source = assignment[speaker]
+        destination = rng.choice([ name for name in sets if name != source ])
+        # Swap only when there is a speaker in the destination to swap with
+        other = rng.choice(members[destination]) if rng.random() < 0.5 and members[destination] else None
+
+        before = costs[source] + costs[destination]
+        _add_speaker(states[source], speaker_stats[speaker], -1)
+        _add_speaker(states[destination], speaker_stats[speaker])
+        if other:
+            _add_speaker(states[destination], speaker_stats[other], -1)
+            _add_speaker(states[source], speaker_stats[other])
+        source_cost = cost_of(source)
+        destination_cost = cost_of(destination)
+
+        if source_cost + destination_cost < before:
+            costs[source] = source_cost
+            costs[destination] = destination_cost
+            assignment[speaker] = destination
+            members[source].remove(speaker)
+            members[destination].append(speaker)
+            if other:
+                assignment[other] = source
+                members[destination].remove(other)
+                members[source].append(other)
+        else:
+            # Undo the move
+            _add_speaker(states[destination], speaker_stats[speaker], -1)
+            _add_speaker(states[source], speaker_stats[speaker])
+            if other:
+                _add_speaker(states[source], speaker_stats[other], -1)
+                _add_speaker(states[destination], speaker_stats[other])
+
+    return members['train'], members['dev'], members.get('test')
+
+
+def save_assignment(partition, file_name):
+    with open(file_name, 'w') as f:
+        f.write('speaker_id,set\n')
+        for name, speakers in zip(['train', 'dev', 'test'], partition):
+            for speaker in speakers or []:
+                f.write("{},{}\n".format(speaker, name))
+
+
+def load_assignment(file_name):
+    partition = {'train': [], 'dev': [], 'test': []}
+    with open(file_name, 'r') as f:
+        f.readline() # Skip header row
+        for line in f:
+            speaker, name = line.rstrip('\n').rsplit(',', 1)
+            partition[name].append(speaker)
+    return partition['train'], partition['dev'], partition['test'] or None
+
+
 def collect_data(data_list, partition):
-    train, dev, test = partition
+    if isinstance(data_list, Manifest):
+        return _collect_manifest(data_list, partition)
+    train, dev, test = [ set(speakers) if speakers else None for speakers in partition ]
     d_train = []
     d_dev = []
     d_test = [] if test else None
@@ -312,7 +722,7 @@ def collect_data(data_list, partition):
             d_train.append(item)
         elif speaker_id in dev:
             d_dev.append(item)
-        elif speaker_id in test and test:
+        elif test and speaker_id in test:
             d_test.append(item)
 
     count_train = len(d_train)
@@ -325,6 +735,92 @@ def collect_data(data_list, partition):
     return d_train, d_dev, d_test
 
 
+# collect_data for a Manifest, looks up the set of every speaker code once
+# and returns one Manifest per set
+def _collect_manifest(manifest, partition):
+    speaker_sets = {}
+    for i, speakers in enumerate(partition):
+        for speaker in speakers or []:
+            speaker_sets.setdefault(speaker, i)
+    speakers = manifest.column('speaker_id')
+    code_sets = [ speaker_sets.get(value) for value in speakers.values ]
+    indices = [ array('I'), array('I'), array('I') ]
+    for i, code in enumerate(speakers.codes):
+        s = code_sets[code]
+        if s is not None:
+            indices[s].append(i)
+
+    d_train, d_dev, d_test = [ manifest.take(rows) for rows in indices ]
+    if not partition[2]:
+        d_test = None
+    count_train = len(d_train)
+    count_dev = len(d_dev)
+    count_test = len(d_test) if d_test is not None else 0
+    if count_train + count_dev + count_test != len(manifest):
+        print("Counts don't add up...")
+        sys.exit(1)
+    print(count_train, count_dev, count_test)
+    return d_train, d_dev, d_test
+
+
+# Cache entries are named by a hash of the input file (the binary manifest
+# next to it if that is what is read), the fix_data flags and the source of
+# the code that parses, filters and normalizes the rows (this file,
+# manifest.py, process_spl.py for clean_speaker_id and the normalization
+# code), so any change to those gives a
+# new entry instead of stale data. The name starts with a hash of the path
+# of the input file, so older entries for it can be found and removed.
+def fixed_cache_key(file_name, skip_speaker_id=False, any_duration=False):
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update("{}\0{}\0{}\0".format(FIXED_CACHE_VERSION, skip_speaker_id, any_duration).encode('utf-8'))
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    read_file = binary_file(file_name) or file_name
+    for source in ['split_dataset.py', 'manifest.py', 'process_spl.py', 'util.py', 'number_to_word.py', read_file]:
+        path = source if source == read_file else os.path.join(source_dir, source)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(block)
+    input_hash = hashlib.blake2b(os.path.abspath(file_name).encode('utf-8'), digest_size=8).hexdigest()
+    return "{}-{}".format(input_hash, hasher.hexdigest())
+
+
+# Returns (fixed data as a memory mapped Manifest, speaker stats), or None if
+# there is no entry for key
+def load_fixed_cache(cache_dir, key):
+    try:
+        with open(os.path.join(cache_dir, key + '.pickle'), 'rb') as f:
+            entry = pickle.load(f)
+        if entry.get('version') != FIXED_CACHE_VERSION or entry.get('key') != key:
+            return None
+        return open_binary(os.path.join(cache_dir, key + '.manifest')), entry['speaker_stats']
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+
+
+def save_fixed_cache(cache_dir, key, data, speaker_stats):
+    os.makedirs(cache_dir, exist_ok=True)
+    write_binary(data, os.path.join(cache_dir, key + '.manifest'))
+    # The stats are written last, an entry is only used once they exist
+    stats_file = os.path.join(cache_dir, key + '.pickle')
+    tmp_file = stats_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump({'version': FIXED_CACHE_VERSION, 'key': key, 'speaker_stats': speaker_stats}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, stats_file)
+    prune_fixed_cache(cache_dir, key)
+
+
+# Removes the other entries for the input file of key, only the newest entry
+# per input file is kept
+def prune_fixed_cache(cache_dir, key):
+    prefix = key.split('-', 1)[0] + '-'
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and not name.startswith(key + '.'):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+
 def format_data_for_csv(data):
     file_name = data['wav_file_name']
     file_size = int(data['file_size'])
@@ -332,20 +828,87 @@ def format_data_for_csv(data):
     return "{},{},{}\n".format(file_name, file_size, text)
 
 
-def save_splits(train, dev, test, prefix=''):
+def save_splits(train, dev, test, prefix='', binary=False):
     HEADER = 'wav_filename,wav_filesize,transcript\n'
     def write_csv(file_name, data):
         with open(file_name, 'w') as f:
             f.write(HEADER)
             for d in data:
                 f.write(format_data_for_csv(d))
+        if binary:
+            if isinstance(data, Manifest):
+                data = data.select(PROCESSED_COLUMNS)
+            else:
+                data = Manifest.from_rows(data, PROCESSED_COLUMNS)
+            write_binary(data, binary_file_name(file_name))
     write_csv("{}train.csv".format(prefix), train)
     write_csv("{}dev.csv".format(prefix), dev)
     if test:
         write_csv("{}test.csv".format(prefix), test)
 
 
+# Second pass of a streaming split, writes every row straight to the file of
+# the set its speaker belongs to, and to its binary manifest with binary
+def save_splits_streaming(data_list, partition, prefix='', binary=False):
+    HEADER = 'wav_filename,wav_filesize,transcript\n'
+    names = ['train', 'dev', 'test']
+    speaker_sets = {}
+    for name, speakers in zip(names, partition):
+        for speaker in speakers or []:
+            speaker_sets[speaker] = name
+
+    files = {}
+    writers = {}
+    counts = { name: 0 for name in names }
+    total = 0
+    try:
+        for name, speakers in zip(names, partition):
+            if speakers:
+                file_name = "{}{}.csv".format(prefix, name)
+                files[name] = open(file_name, 'w')
+                files[name].write(HEADER)
+                if binary:
+                    writers[name] = BinaryWriter(binary_file_name(file_name), PROCESSED_COLUMNS)
+        for d in data_list:
+            total += 1
+            name = speaker_sets.get(d['speaker_id'])
+            if name not in files:
+                continue
+            line = format_data_for_csv(d)
+            files[name].write(line)
+            if binary:
+                # Parsed back from the line so both files hold the same values
+                writers[name].append(parse_processed_line(line))
+            counts[name] += 1
+    except BaseException:
+        for writer in writers.values():
+            writer.discard()
+        raise
+    finally:
+        for f in files.values():
+            f.close()
+
+    if sum(counts.values()) != total:
+        for writer in writers.values():
+            writer.discard()
+        print("Counts don't add up...")
+        sys.exit(1)
+    print(counts['train'], counts['dev'], counts['test'])
+    # After the csv files are closed, so the manifests are the newer files
+    for writer in writers.values():
+        writer.close()
+
+
 def main(args):
+    report = instrument.Report('split_dataset', progress_interval=args.progress)
+    try:
+        run(args, report)
+    finally:
+        if args.report:
+            report.save(args.report)
+
+
+def run(args, report):
     if args.any_split:
         print('Allowing any split')
         global TH_GENDER
@@ -371,33 +934,83 @@ def main(args):
             sys.exit(1)
         splits['test'] = args.split[2]
 
-    print("Loading data from file {}".format(args.file))
-    all_data = _load_data(args.file)
-
-    print("Fixing data")
-    all_data = fix_data(all_data, skip_speaker_id=args.skip_speaker, any_duration=args.any_duration)
-
-    print("Building speaker stats cache")
-    speaker_stats = build_speaker_stats(all_data)
-
-    if args.seed:
-        print("Doing a single split using seed: {}".format(args.seed))
-        balanced, partition = do_split(speaker_stats, splits, args.seed, args.skip_region, args.skip_gender, verbose=True)
+    cache_key = None
+    cached = None
+    if not args.no_cache:
+        with report.stage('load_cache'):
+            cache_key = fixed_cache_key(args.file, skip_speaker_id=args.skip_speaker, any_duration=args.any_duration)
+            cached = load_fixed_cache(args.cache_dir, cache_key)
+
+    if cached:
+        print("Using fixed data and speaker stats of file {} from cache {}".format(args.file, args.cache_dir))
+        all_data, speaker_stats = cached
+    elif args.streaming:
+        print("Building speaker stats cache from file {}".format(args.file))
+        with report.stage('build_speaker_stats'):
+            speaker_stats = build_speaker_stats(iter_fixed_data(_iter_data(args.file), skip_speaker_id=args.skip_speaker, any_duration=args.any_duration, normalize_text=False))
     else:
-        seed = DEFAULT_SEED
-        print("Starting search for a good split, starting with seed: {}".format(seed))
-        balanced = False
-        while not balanced:
-            balanced, partition = do_split(speaker_stats, splits, seed, args.skip_region, args.skip_gender, verbose=True)
-            if not balanced:
-                seed = random.randint(1, 9999999)
-        print("\n\nSplit successful using seed: {}".format(seed))
+        print("Loading data from file {}".format(args.file))
+        with report.stage('load_data') as stage:
+            all_data = load_manifest(args.file)
+            stage.add(len(all_data))
+
+        print("Fixing data")
+        with report.stage('fix_data') as stage:
+            rows = len(all_data)
+            all_data = fix_data(all_data, skip_speaker_id=args.skip_speaker, any_duration=args.any_duration, timers=stage.timers)
+            stage.add(rows, kept=len(all_data))
+
+        print("Building speaker stats cache")
+        with report.stage('build_speaker_stats'):
+            speaker_stats = build_speaker_stats(all_data)
+        if cache_key:
+            with report.stage('save_cache'):
+                save_fixed_cache(args.cache_dir, cache_key, all_data, speaker_stats)
+    with report.stage('build_speaker_matrix'):
+        speaker_matrix = build_speaker_matrix(speaker_stats)
+
+    with report.stage('split') as stage:
+        if args.assignment:
+            print("Using speaker assignment from file: {}".format(args.assignment))
+            partition = load_assignment(args.assignment)
+            balanced = check_balance(speaker_stats, *partition, splits, args.skip_region, args.skip_gender, verbose=True, matrix=speaker_matrix)
+        elif args.solver:
+            seed = args.seed or DEFAULT_SEED
+            print("Solving for a balanced split using seed: {}".format(seed))
+            partition = solve_partition(speaker_stats, splits, seed, args.skip_region, args.skip_gender, iterations=args.solver_iterations, matrix=speaker_matrix)
+            balanced = check_balance(speaker_stats, *partition, splits, args.skip_region, args.skip_gender, verbose=True, matrix=speaker_matrix)
+            if balanced or args.accept_unbalanced:
+                assignment_file = "{}split-assignment.csv".format(args.out_prefix)
+                save_assignment(partition, assignment_file)
+                print("\n\nSolver {} using seed: {}, speaker assignment saved to {}".format('successful' if balanced else 'did not find a balanced split', seed, assignment_file))
+        elif args.seed:
+            print("Doing a single split using seed: {}".format(args.seed))
+            balanced, partition = do_split(speaker_stats, splits, args.seed, args.skip_region, args.skip_gender, verbose=True, matrix=speaker_matrix)
+        else:
+            print("Starting search for a good split, starting with seed: {}".format(DEFAULT_SEED))
+            seed = search_seed(speaker_stats, splits, DEFAULT_SEED, args.skip_region, args.skip_gender, jobs=args.jobs, matrix=speaker_matrix, progress_interval=args.progress or SEARCH_PROGRESS_INTERVAL)
+            balanced, partition = do_split(speaker_stats, splits, seed, args.skip_region, args.skip_gender, verbose=True, matrix=speaker_matrix)
+            print("\n\nSplit successful using seed: {}".format(seed))
+        stage.add(len(speaker_stats), balanced=int(balanced))
+
+    if args.solver and not balanced and not args.accept_unbalanced:
+        print("\n\nSolver did not find a balanced split using seed: {}, no files written (use --accept-unbalanced to write them anyway)".format(seed))
+        sys.exit(1)
 
     if args.stats_only:
         sys.exit(0)
 
-    train, dev, test = collect_data(all_data, partition)
-    save_splits(train, dev, test, prefix=args.out_prefix)
+    if args.streaming:
+        print("Writing splits from file {}".format(args.file))
+        with report.stage('save_splits') as stage:
+            fixed_data = all_data if cached else iter_fixed_data(_iter_data(args.file), skip_speaker_id=args.skip_speaker, any_duration=args.any_duration, timers=stage.timers)
+            save_splits_streaming(fixed_data, partition, prefix=args.out_prefix, binary=args.binary)
+        return
+
+    with report.stage('collect_data'):
+        train, dev, test = collect_data(all_data, partition)
+    with report.stage('save_splits'):
+        save_splits(train, dev, test, prefix=args.out_prefix, binary=args.binary)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
 import re
 import tempfile
-from .number_to_word import to_words
+from functools import partial
+from multiprocessing import Pool
+from manifest import load_processed_manifest
+from number_to_word import to_words
 
 units = {
     'mm': 'millimeter',
@@ -14,9 +17,8 @@ units = {
     'l': 'liter',
 }
 
-re_units = {}
-for key, _ in units.items():
-    re_units[key] = re.compile(r"\b{0}(²|³)?\b".format(re.escape(key)))
+# All units in one pass, the matched unit is looked up in units
+re_units = re.compile(r"\b({0})(²|³)?\b".format("|".join(re.escape(key) for key in units)))
 
 re_square = re.compile(r"([\w]+)²")
 re_cubic  = re.compile(r"([\w]+)³")
@@ -31,50 +33,80 @@ re_numbers = re.compile(r"\d+")
 re_spaces = re.compile(r"\s\s+")                    # matches 2 or more consecutive spaces
 re_replace_all = re.compile(r"[^a-z|å|ä|ö|\s]")
 
+# Character replacements done in a single str.translate each, the second one
+# has to run after the digit regexes since they look at '-'
+CHARACTERS = str.maketrans({
+    '|': None,
+    '"': None,
+    '.': None,
+    '(': None,
+    ')': None,
+    '[': None,
+    ']': None,
+    '_': ' ',
+    '\\': ' ',
+    'é': 'e',
+    '&': 'och',
+    '\xa0': ' ',
+})
+CHARACTERS_AFTER_DIGITS = str.maketrans({
+    '-': ' ',
+    '%': 'procent',
+})
+
 TMP_DIR = tempfile.mkdtemp()
 
 
+def _unit_to_word(match):
+    return units[match.group(1)] + (match.group(2) or '')
+
+
+def _number_to_word(match):
+    match = match.group()
+    word = match
+    try:
+        word = to_words(match)
+    except ValueError as ex:
+        print('Failed to convert "{}": {}'.format(match, ex))
+    return word
+
+
 def normalize(text, is_nst=False, remove_spaces_between_digits=True):
     text = text.lower()
+    if is_nst:
+        # NST transcripts are read with their commas, every comma separates
+        # two words (e.g. "6,2 dl" is "sex två deciliter", "hej,då" is "hej då")
+        text = text.replace(',', ' ')
     text = re_remove_silent_date.sub('', text)
-    text = text.replace('|', '')
-    text = text.replace('"', '')
-    text = text.replace('.', '')
-    text = text.replace('(', '')
-    text = text.replace(')', '')
-    text = text.replace('[', '')
-    text = text.replace(']', '')
-    text = text.replace("_", " ")
-    text = text.replace("\\", " ")
-    text = text.replace("é", "e")
-    text = text.replace("&", "och")
-    text = text.replace(u'\xa0', ' ')
+    text = text.translate(CHARACTERS)
     if not is_nst:
-        for key, pattern in re_units.items():
-            replacement = r"{0}\1".format(re.escape(units[key]))
-            text = pattern.sub(replacement, text)
+        text = re_units.sub(_unit_to_word, text)
         text = re_square.sub(r"kvadrat\1", text)
         text = re_cubic.sub(r"kubik\1", text)
         if remove_spaces_between_digits:
             text = re_combine_digits.sub(r"\1\3", text)
         text = re_sep_decimals.sub(r"\1 komma \2", text)
         text = re_digit_range.sub(r"\1 till \2", text)
-    text = text.replace('-', ' ')
-    text = text.replace('%', 'procent')
-    def number_to_word(match):
-        match = match.group()
-        word = match
-        try:
-            word = to_words(match)
-        except ValueError as ex:
-            print('Failed to convert "{}": {}'.format(match, ex))
-        return word
-    text = re_numbers.sub(number_to_word, text)
+    text = text.translate(CHARACTERS_AFTER_DIGITS)
+    text = re_numbers.sub(_number_to_word, text)
     text = re_replace_all.sub('', text)
     text = re_spaces.sub(' ', text)
     return text.strip()
 
 
+# Normalizes every text in texts, in order. With jobs > 1 the work is spread
+# over a pool of worker processes.
+def normalize_many(texts, jobs=1, is_nst=False, remove_spaces_between_digits=True):
+    func = partial(normalize, is_nst=is_nst, remove_spaces_between_digits=remove_spaces_between_digits)
+    if jobs <= 1:
+        for text in texts:
+            yield func(text)
+        return
+    with Pool(jobs) as pool:
+        for text in pool.imap(func, texts, chunksize=256):
+            yield text
+
+
 def load_processed_train():
     return load_processed("train.csv")
 
@@ -84,16 +116,7 @@ def load_processed_dev():
 def load_processed_test():
     return load_processed("real-test-2.csv")
 
+# Reads the binary manifest next to filename if split_dataset.py --binary
+# wrote one. file_size is kept as a string like in the csv file.
 def load_processed(filename):
-    data = []
-    with open(filename, "r") as f:
-        f.readline()
-        for line in f:
-            row = line.split(",")
-            item = {
-                "wav_file_name": row[0].strip(),
-                "file_size": row[1].strip(),
-                "text": " ".join(row[2:]).strip()
-            }
-            data.append(item)
-    return data
+    return [ dict(row, file_size=str(row["file_size"])) for row in load_processed_manifest(filename) ]
@@ -0,0 +1,112 @@
+import os
+import struct
+import subprocess
+import sys
+
+DEV_NULL = open(os.devnull, 'w')
+
+# Formats where the duration can be derived from the data chunk size alone
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_ALAW = 0x0006
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+SUPPORTED_FORMATS = [
+    WAVE_FORMAT_PCM,
+    WAVE_FORMAT_IEEE_FLOAT,
+    WAVE_FORMAT_ALAW,
+    WAVE_FORMAT_MULAW,
+    WAVE_FORMAT_EXTENSIBLE
+]
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+def read_header(file_name):
+    # Reads the RIFF/WAVE header of file_name without decoding any audio.
+    # Raises UnsupportedFormat if the file is not a plain WAVE file.
+    file_size = os.path.getsize(file_name)
+    fmt = None
+    with open(file_name, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            raise UnsupportedFormat('Not a RIFF/WAVE file: {}'.format(file_name))
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise UnsupportedFormat('No data chunk in: {}'.format(file_name))
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+            if chunk_id == b'fmt ':
+                data = f.read(chunk_size)
+                if len(data) < 16:
+                    raise UnsupportedFormat('Truncated fmt chunk in: {}'.format(file_name))
+                fmt = struct.unpack('<HHIIHH', data[:16])
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                if not fmt:
+                    raise UnsupportedFormat('Data chunk before fmt chunk in: {}'.format(file_name))
+                # Streamed or truncated files can have a bogus chunk size
+                data_size = min(chunk_size, file_size - f.tell())
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+    format_tag, channels, sample_rate, _, block_align, bits_per_sample = fmt
+    if format_tag not in SUPPORTED_FORMATS or sample_rate == 0 or block_align == 0:
+        raise UnsupportedFormat('Unsupported wav format {} in: {}'.format(format_tag, file_name))
+    frames = data_size // block_align
+    return {
+        # Same precision as `soxi -D` so manifests don't change
+        'duration': float('{:f}'.format(frames / sample_rate)),
+        'channels': channels,
+        'sample_rate': sample_rate,
+        'sample_width': (bits_per_sample + 7) // 8,
+        'frames': frames
+    }
+
+
+def _soxi(flag, file_name):
+    return subprocess.check_output(['soxi', flag, file_name], stderr=DEV_NULL).strip()
+
+
+# soxi flag and conversion of every field returned by read_header
+SOXI_FIELDS = {
+    'duration': ('-D', float),
+    'channels': ('-c', int),
+    'sample_rate': ('-r', int),
+    'sample_width': ('-b', lambda bits: int(bits) // 8),
+    'frames': ('-s', int)
+}
+
+
+def read_header_soxi(file_name, fields=None):
+    # Slow path, spawns soxi for formats read_header doesn't understand. soxi
+    # prints one field per call, so only the fields asked for are read
+    result = {}
+    for field in fields or SOXI_FIELDS:
+        flag, convert = SOXI_FIELDS[field]
+        result[field] = convert(_soxi(flag, file_name))
+    return result
+
+
+# fields limits what the soxi fallback reads, read_header returns every field
+def probe(file_name, fields=None):
+    try:
+        return read_header(file_name)
+    except UnsupportedFormat:
+        return read_header_soxi(file_name, fields)
+
+
+def duration(file_name):
+    return probe(file_name, ['duration'])['duration']
+
+
+def channels(file_name):
+    return probe(file_name, ['channels'])['channels']
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:]:
+        print(name, probe(name))